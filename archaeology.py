@@ -0,0 +1,1652 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "polars==1.35.2",
+#     "altair==6.0.0",
+#     "diskcache==5.6.3",
+#     "tenacity>=8.0.0",
+#     "httpx>=0.27.0",
+# ]
+# ///
+
+"""Git code archaeology pipeline: clone, sample, blame, aggregate and export charts.
+
+This is the plain, importable core behind the `git_archaeology.py` notebook. Only the
+standard library is imported at module level; diskcache, polars and altair are loaded
+the first time a step needs them, so `--help` and small repos start instantly.
+
+    uv run archaeology.py --repo koaning/scikit-lego --samples 50
+"""
+
+import abc
+import argparse
+import contextlib
+import dataclasses
+import fnmatch
+import functools
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timezone
+from pathlib import Path
+
+DOWNLOADS_DIR = Path(".downloads")
+CACHE_DIR = Path("git-research")
+CHARTS_DIR = Path("charts")
+TILES_DIR = CHARTS_DIR / "tiles"
+
+DEFAULT_EXTENSIONS = ".py,.js,.ts,.java,.c,.cpp,.h,.go,.rs,.rb,.md,.pyx,.cu,.rst"
+DEFAULT_SKIP_GLOBS = "*.min.js,*.min.css,*.map,*.lock,*-lock.json"
+
+
+@dataclasses.dataclass
+class RepoParams:
+    """Parameters for one pipeline run; each field is also a CLI flag."""
+
+    repo: str = dataclasses.field(metadata={"help": "Repository URL (HTTPS)"})
+    samples: int = dataclasses.field(
+        default=200, metadata={"help": "Number of commits to sample"}
+    )
+    file_extensions: str = dataclasses.field(
+        default=DEFAULT_EXTENSIONS,
+        metadata={"help": "Comma-separated file extensions to analyze"},
+    )
+    version_source: str = dataclasses.field(
+        default="git tags", metadata={"help": "Version source: none, git tags, or pypi"}
+    )
+    pypi_name: str = dataclasses.field(
+        default="", metadata={"help": "PyPI package name (defaults to repo name)"}
+    )
+    granularity: str = dataclasses.field(
+        default="Quarter", metadata={"help": "Time granularity: Year or Quarter"}
+    )
+    include: str = dataclasses.field(
+        default="", metadata={"help": "Comma-separated paths or globs to limit the analysis to"}
+    )
+    exclude: str = dataclasses.field(
+        default="", metadata={"help": "Comma-separated paths or globs to leave out"}
+    )
+    subprojects: str = dataclasses.field(
+        default="",
+        metadata={"help": "Comma-separated directories that each get their own chart"},
+    )
+    skip_globs: str = dataclasses.field(
+        default=DEFAULT_SKIP_GLOBS, metadata={"help": "Comma-separated path globs to skip"}
+    )
+    max_file_kb: int = dataclasses.field(
+        default=1024, metadata={"help": "Skip files larger than this many KB (0 disables)"}
+    )
+    honor_gitattributes: bool = dataclasses.field(
+        default=True,
+        metadata={"help": "Skip linguist-generated/linguist-vendored files from .gitattributes"},
+    )
+    blame_timeout: float = dataclasses.field(
+        default=60.0, metadata={"help": "Seconds before a single blame call is skipped"}
+    )
+    backend: str = dataclasses.field(
+        default="subprocess", metadata={"help": "Git backend: subprocess or pygit2 (in-process)"}
+    )
+    prepare: bool = dataclasses.field(
+        default=True,
+        metadata={"help": "Build commit-graph and pack indexes before blaming"},
+    )
+    benchmark_prepare: bool = dataclasses.field(
+        default=False,
+        metadata={"help": "Time blame on the largest files before and after preparing"},
+    )
+    memory_budget_mb: int = dataclasses.field(
+        default=0,
+        metadata={"help": "Memory budget in MB for commits in flight (0: one per worker)"},
+    )
+    tile_samples: int = dataclasses.field(
+        default=0,
+        metadata={"help": "Commits sampled per year for zoomable detail tiles (0 disables)"},
+    )
+
+    def __post_init__(self):
+        # Values from the CLI or marimo's cli_args arrive as strings
+        for field in dataclasses.fields(self):
+            value = getattr(self, field.name)
+            if isinstance(value, str) and field.type is bool:
+                setattr(self, field.name, value.strip().lower() not in ("false", "0", "no", ""))
+            elif isinstance(value, str) and field.type in (int, float):
+                setattr(self, field.name, field.type(value))
+
+    @property
+    def repo_name(self) -> str:
+        return self.repo.rstrip("/").split("/")[-1].replace(".git", "")
+
+    @property
+    def chart_name(self) -> str:
+        """Base name of the exported charts.
+
+        Runs limited to part of the repo, by `include`, `exclude` or by the
+        subprojects standing in for `include`, get a suffix naming that scope,
+        so they never overwrite the whole repo's chart.
+        """
+        name = self.repo_name
+        if include := self.skip_rules["include"]:
+            name += "-" + "-".join(map(scope_slug, include))
+        if exclude := _split_paths(self.exclude):
+            name += "-without-" + "-".join(map(scope_slug, exclude))
+        return name
+
+    @property
+    def extensions(self) -> list[str] | None:
+        extensions_str = self.file_extensions.strip()
+        return [ext.strip() for ext in extensions_str.split(",")] if extensions_str else None
+
+    @property
+    def subproject_paths(self) -> list[str] | None:
+        return _split_paths(self.subprojects)
+
+    @property
+    def pathspecs(self) -> list[str] | None:
+        """Git pathspecs limiting history to the included and not excluded paths."""
+        return make_pathspecs(self.skip_rules["include"], self.skip_rules["exclude"])
+
+    @property
+    def skip_rules(self) -> dict:
+        """Keyword arguments for file selection, as taken by `collect_blame_data`.
+
+        Without an explicit `include`, the subprojects define the analyzed paths.
+        """
+        return {
+            "include": _split_paths(self.include) or self.subproject_paths,
+            "exclude": _split_paths(self.exclude),
+            "skip_globs": [g.strip() for g in self.skip_globs.split(",") if g.strip()] or None,
+            "max_blob_bytes": int(self.max_file_kb * 1024) or None,
+            "honor_gitattributes": self.honor_gitattributes,
+            "blame_timeout": self.blame_timeout,
+        }
+
+
+def _split_paths(paths: str) -> list[str] | None:
+    return [p.strip().strip("/") for p in paths.split(",") if p.strip().strip("/")] or None
+
+
+# ========================================
+# Lazy cache
+# ========================================
+
+_cache = None
+
+
+def get_cache():
+    """Open the shared diskcache on first use."""
+    global _cache
+    if _cache is None:
+        from diskcache import Cache
+
+        _cache = Cache(str(CACHE_DIR), timeout=300)
+    return _cache
+
+
+def memoize(**memoize_kwargs):
+    """`Cache.memoize` that defers opening the cache until the first call.
+
+    The cache key name defaults to the function name rather than its module path,
+    so results are shared between the CLI (`__main__`) and importers such as the
+    notebook. Pass `name=` to start fresh when a function's return value changes.
+    """
+
+    def decorator(func):
+        memoized = None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            nonlocal memoized
+            if memoized is None:
+                memoized = get_cache().memoize(**{"name": func.__name__, **memoize_kwargs})(func)
+            return memoized(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# ========================================
+# Repository download
+# ========================================
+
+
+def resolve_repo_url(repo: str) -> str:
+    """URL to clone and fetch a repo reference from.
+
+    Short GitHub references ("koaning/scikit-lego") become HTTPS URLs and local
+    paths absolute file:// URLs; any other URL is used as given, so SSH remotes
+    keep using the user's keys.
+    """
+    repo_url = repo.strip()
+    if repo_url.startswith(("/", "./", "../", "~")):
+        return Path(repo_url).expanduser().resolve().as_uri()
+    if repo_url.startswith("file://"):
+        return Path(repo_url[len("file://") :]).resolve().as_uri()
+    if "/" in repo_url and "://" not in repo_url and not repo_url.startswith("git@"):
+        return f"https://github.com/{repo_url.strip('/')}"
+    return repo_url
+
+
+def normalize_repo_url(repo: str) -> str:
+    """Identity of a repo reference, so that equivalent forms share one cache entry.
+
+    SSH remotes and HTTP(S) URLs with or without ".git" or a trailing slash all
+    map to the same HTTPS URL. Only used as a key, never to clone from.
+    """
+    repo_url = resolve_repo_url(repo).rstrip("/")
+    if repo_url.startswith("file://"):
+        return repo_url
+    if repo_url.startswith("git@") and ":" in repo_url:
+        host, path = repo_url[len("git@") :].split(":", 1)
+        repo_url = f"https://{host}/{path}"
+    elif repo_url.startswith("http://"):
+        repo_url = "https://" + repo_url[len("http://") :]
+    repo_url = repo_url.removesuffix(".git")
+    scheme, _, rest = repo_url.partition("://")
+    host, _, path = rest.partition("/")
+    if host.lower() == "github.com":
+        # GitHub owner and repo names are case-insensitive
+        path = path.lower()
+    return f"{scheme}://{host.lower()}/{path}"
+
+
+def get_cached_repo_path(repo_url: str) -> Path:
+    """Get the cached path for a repo URL, using a hash of its normalized form for uniqueness."""
+    repo_key = normalize_repo_url(repo_url)
+    repo_name = repo_key.rstrip("/").split("/")[-1].replace(".git", "")
+    url_hash = hashlib.md5(repo_key.encode(), usedforsecurity=False).hexdigest()[:8]
+    return DOWNLOADS_DIR / f"{repo_name}-{url_hash}"
+
+
+# Bare repository holding the objects of every downloaded repo. Clones borrow
+# from it through git alternates, so forks and mirrors are only stored once.
+OBJECT_STORE = DOWNLOADS_DIR / "objects.git"
+_object_store_lock = threading.Lock()
+
+
+def fetch_into_object_store(repo_url: str):
+    """Fetch a repo's branches and tags into the shared store under its own ref namespace.
+
+    Keeping refs per repo makes every object reachable, so the store is never pruned
+    from under a clone, and fetching a fork only downloads what the store lacks.
+    """
+    repo_key = normalize_repo_url(repo_url)
+    url_hash = hashlib.md5(repo_key.encode(), usedforsecurity=False).hexdigest()[:8]
+    prefix = f"refs/gitcharts/{url_hash}"
+    with _object_store_lock:
+        if not OBJECT_STORE.exists():
+            subprocess.run(
+                ["git", "init", "--bare", "-q", str(OBJECT_STORE)],
+                capture_output=True,
+                check=True,
+            )
+        subprocess.run(
+            [
+                "git",
+                "fetch",
+                "-q",
+                "--no-tags",
+                repo_url,
+                f"+refs/heads/*:{prefix}/heads/*",
+                f"+refs/tags/*:{prefix}/tags/*",
+            ],
+            cwd=OBJECT_STORE,
+            capture_output=True,
+        )
+
+
+def clone_or_update_repo(repo_url: str) -> Path:
+    """Clone repo if not cached, otherwise return cached path.
+
+    Objects are fetched into the shared OBJECT_STORE first; the per-repo clone
+    references it as an alternate and only keeps its own refs and working tree.
+    """
+    DOWNLOADS_DIR.mkdir(exist_ok=True)
+    repo_path = get_cached_repo_path(repo_url)
+    fetch_into_object_store(repo_url)
+
+    if repo_path.exists():
+        # Repo already cached: fetch latest and move HEAD to the remote's default branch,
+        # since commits are listed from HEAD and a fetch alone leaves the local branch behind
+        for cmd in (
+            ["git", "fetch", "--all", "--prune"],
+            ["git", "remote", "set-head", "origin", "--auto"],
+            ["git", "reset", "-q", "--hard", "origin/HEAD"],
+        ):
+            subprocess.run(cmd, cwd=repo_path, capture_output=True)
+    else:
+        # Clone fresh
+        subprocess.run(
+            ["git", "clone", "--reference", str(OBJECT_STORE.resolve()), repo_url, str(repo_path)],
+            capture_output=True,
+            check=True,
+        )
+        # A relative alternate keeps .downloads relocatable
+        alternates = repo_path / ".git" / "objects" / "info" / "alternates"
+        store_objects = os.path.relpath(OBJECT_STORE / "objects", alternates.parent.parent)
+        alternates.write_text(store_objects + "\n")
+    return repo_path
+
+
+def alternate_stores(repo_path: Path) -> list[Path]:
+    """Repositories whose object directories `repo_path` borrows from."""
+    objects_dir = _git_dir(repo_path) / "objects"
+    alternates = objects_dir / "info" / "alternates"
+    if not alternates.exists():
+        return []
+    stores = []
+    for line in alternates.read_text().splitlines():
+        if line.strip() and not line.startswith("#"):
+            store = (objects_dir / line.strip()).resolve().parent
+            if store.exists():
+                stores.append(store)
+    return stores
+
+
+# ========================================
+# Repository preparation
+# ========================================
+
+PREPARED_MARKER = "gitcharts-prepared"
+
+
+def _git_dir(repo_path: Path) -> Path:
+    return Path(run_git_command(["git", "rev-parse", "--absolute-git-dir"], str(repo_path)).strip())
+
+
+def refs_fingerprint(repo_path: Path) -> str:
+    """Hash of every ref and HEAD; changes whenever a fetch brings in new history."""
+    refs = run_git_command(
+        ["git", "for-each-ref", "--format=%(objectname) %(refname)"], str(repo_path)
+    )
+    # A bare object store has no HEAD to resolve
+    head = subprocess.run(
+        ["git", "rev-parse", "--verify", "-q", "HEAD"],
+        cwd=repo_path,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return hashlib.sha256((head + refs).encode()).hexdigest()
+
+
+def time_blame(
+    repo_path: Path, extensions: list[str] | None = None, n_files: int = 3
+) -> float | None:
+    """Seconds spent blaming the largest matching files at HEAD, or None without files."""
+    entries = [
+        (size, path)
+        for path, obj_type, _, size in SubprocessBackend().list_tree(str(repo_path), "HEAD")
+        if obj_type == "blob" and (not extensions or any(path.endswith(e) for e in extensions))
+    ]
+    largest = [path for _, path in sorted(entries, reverse=True)[:n_files]]
+    if not largest:
+        return None
+    start = time.perf_counter()
+    for path in largest:
+        subprocess.run(
+            ["git", "blame", "-t", "HEAD", "--", path], cwd=repo_path, capture_output=True
+        )
+    return time.perf_counter() - start
+
+
+def prepare_repo(
+    repo_path: Path, extensions: list[str] | None = None, benchmark: bool = False
+) -> dict:
+    """Build the indexes that make blame fast, if the repo changed since the last run.
+
+    Writes the commit-graph with changed-path Bloom filters (blame uses them to
+    skip commits that did not touch a file), packs loose objects from fetches
+    and indexes all packs in a multi-pack-index, so object lookups do not have
+    to probe every pack. Existing packs are not rewritten, and `-l` keeps
+    objects borrowed from an alternate object store out of the local pack.
+
+    The shared object store the clone borrows from is prepared the same way,
+    since that is where most of its objects live.
+
+    Returns {"prepared": bool, "before": seconds | None, "after": seconds | None};
+    blame timings are only measured when `benchmark` is set.
+    """
+    report = {"prepared": False, "before": None, "after": None}
+    stale = []
+    for path in [*alternate_stores(repo_path), Path(repo_path)]:
+        marker = _git_dir(path) / PREPARED_MARKER
+        fingerprint = refs_fingerprint(path)
+        if not (marker.exists() and marker.read_text() == fingerprint):
+            stale.append((path, marker, fingerprint))
+    if not stale:
+        return report
+
+    if benchmark:
+        report["before"] = time_blame(repo_path, extensions)
+    for path, marker, fingerprint in stale:
+        is_store = path != Path(repo_path)
+        # Jobs for other repos fetch into and prepare the shared store too; concurrent
+        # writes would collide on git's lock files and fail
+        with _object_store_lock if is_store else contextlib.nullcontext():
+            if is_store:
+                fingerprint = refs_fingerprint(path)
+            run_git_command(["git", "repack", "-d", "-l", "-q"], str(path))
+            # A clone whose objects all live in the shared store has no packs to index
+            if any((_git_dir(path) / "objects" / "pack").glob("*.pack")):
+                run_git_command(["git", "multi-pack-index", "write"], str(path))
+            run_git_command(
+                ["git", "commit-graph", "write", "--reachable", "--changed-paths"], str(path)
+            )
+            marker.write_text(fingerprint)
+    if benchmark:
+        report["after"] = time_blame(repo_path, extensions)
+
+    report["prepared"] = True
+    return report
+
+
+# ========================================
+# Git backends
+# ========================================
+
+# Pre-compile regex for timestamp extraction (used in SubprocessBackend.blame)
+TIMESTAMP_PATTERN = re.compile(r"\(.*?\s+(\d{10})\s+[+-]\d{4}\s+\d+\)")
+
+
+def run_git_command(cmd: list[str], repo_path: str, timeout: float | None = None) -> str:
+    """Run a git command and return stdout."""
+    result = subprocess.run(
+        cmd,
+        cwd=repo_path,
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+        timeout=timeout,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Git command failed: {result.stderr}")
+    return result.stdout
+
+
+class GitBackend(abc.ABC):
+    """The git operations the analysis needs; subclasses decide how to run them."""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def list_commits(
+        self, repo_path: str, pathspecs: list[str] | None = None
+    ) -> list[tuple[str, int]]:
+        """(commit_hash, author_timestamp) pairs reachable from HEAD, oldest first.
+
+        With `pathspecs`, only commits touching those paths, like `git log -- <pathspecs>`.
+        """
+
+    @abc.abstractmethod
+    def list_tree(
+        self, repo_path: str, commit_hash: str, paths: list[str] | None = None
+    ) -> list[tuple[str, str, str, int | None]]:
+        """(path, object_type, object_hash, size) for every entry, like ls-tree -r -l.
+
+        With `paths`, only the entries below those literal paths are read.
+        """
+
+    @abc.abstractmethod
+    def read_blob(self, repo_path: str, blob_hash: str) -> str:
+        """Decoded text content of a blob."""
+
+    @abc.abstractmethod
+    def blame(
+        self, repo_path: str, commit_hash: str, file_path: str, timeout: float | None = None
+    ) -> list[int] | None:
+        """Author timestamp per line; [] when unblameable, None when timed out."""
+
+
+class SubprocessBackend(GitBackend):
+    """Shells out to the git CLI and parses its text output."""
+
+    name = "subprocess"
+
+    def list_commits(self, repo_path, pathspecs=None):
+        output = run_git_command(
+            ["git", "log", "--format=%H %at", "--reverse", "--", *(pathspecs or [])],
+            repo_path,
+        )
+        commits = []
+        for line in output.strip().split("\n"):
+            if line:
+                commit_hash, timestamp = line.split()
+                commits.append((commit_hash, int(timestamp)))
+        return commits
+
+    def list_tree(self, repo_path, commit_hash, paths=None):
+        output = run_git_command(
+            ["git", "ls-tree", "-r", "-l", commit_hash, "--", *(paths or [])],
+            repo_path,
+        )
+        entries = []
+        for line in output.strip().split("\n"):
+            if not line:
+                continue
+            # Format: <mode> <type> <blob_hash> <size>\t<path>
+            meta, file_path = line.split("\t", 1)
+            _, obj_type, obj_hash, size = meta.split()
+            entries.append((file_path, obj_type, obj_hash, int(size) if size != "-" else None))
+        return entries
+
+    def read_blob(self, repo_path, blob_hash):
+        # Decoded by hand: text mode would translate the blob's CRLF line endings
+        result = subprocess.run(
+            ["git", "cat-file", "blob", blob_hash], cwd=repo_path, capture_output=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"Git command failed: {result.stderr.decode(errors='replace')}")
+        return result.stdout.decode("utf-8")
+
+    def blame(self, repo_path, commit_hash, file_path, timeout=None):
+        try:
+            output = run_git_command(
+                ["git", "blame", "-t", commit_hash, "--", file_path],
+                repo_path,
+                timeout=timeout,
+            )
+        except subprocess.TimeoutExpired:
+            return None
+        except (RuntimeError, UnicodeDecodeError):
+            return []
+
+        return [
+            int(m.group(1))
+            for line in output.split("\n")
+            if line and (m := TIMESTAMP_PATTERN.search(line))
+        ]
+
+
+class Pygit2Backend(GitBackend):
+    """In-process backend on libgit2: no process spawning and no text parsing.
+
+    The blame timeout is not enforced here, libgit2 blame cannot be interrupted.
+    """
+
+    name = "pygit2"
+
+    def __init__(self):
+        try:
+            import pygit2
+        except ImportError as e:
+            raise ImportError(
+                "The pygit2 backend needs pygit2: `uv run --with pygit2 archaeology.py ...`"
+            ) from e
+        self._pygit2 = pygit2
+        self._repos = {}
+
+    def _repo(self, repo_path):
+        # libgit2 repository handles are not safe to share across threads
+        key = (str(repo_path), threading.get_ident())
+        if key not in self._repos:
+            self._repos[key] = self._pygit2.Repository(str(repo_path))
+        return self._repos[key]
+
+    def list_commits(self, repo_path, pathspecs=None):
+        if pathspecs:
+            # libgit2 has no history simplification by path; git log defines it
+            return SubprocessBackend().list_commits(repo_path, pathspecs)
+        repo = self._repo(repo_path)
+        SortMode = self._pygit2.enums.SortMode
+        # Topological + time ordering matches `git log --reverse` (children never first)
+        sort = SortMode.TOPOLOGICAL | SortMode.TIME | SortMode.REVERSE
+        return [(str(c.id), c.author.time) for c in repo.walk(repo.head.target, sort)]
+
+    def list_tree(self, repo_path, commit_hash, paths=None):
+        repo = self._repo(repo_path)
+        odb = repo.odb
+        entries = []
+
+        def walk(tree, prefix):
+            for entry in tree:
+                path = prefix + entry.name
+                if entry.type_str == "tree":
+                    walk(repo[entry.id], path + "/")
+                elif entry.type_str == "blob":
+                    entries.append((path, "blob", str(entry.id), odb.read_header(entry.id)[1]))
+                else:
+                    entries.append((path, entry.type_str, str(entry.id), None))
+
+        root = repo.revparse_single(commit_hash).peel(self._pygit2.Tree)
+        if not paths:
+            walk(root, "")
+            return entries
+        # Only descend into the requested subtrees
+        for path in paths:
+            try:
+                obj = root[path]
+            except KeyError:
+                continue
+            if obj.type_str == "tree":
+                walk(repo[obj.id], path + "/")
+            elif obj.type_str == "blob":
+                entries.append((path, "blob", str(obj.id), odb.read_header(obj.id)[1]))
+        return entries
+
+    def read_blob(self, repo_path, blob_hash):
+        return self._repo(repo_path)[blob_hash].data.decode("utf-8")
+
+    def blame(self, repo_path, commit_hash, file_path, timeout=None):
+        repo = self._repo(repo_path)
+        try:
+            tree = repo.revparse_single(commit_hash).peel(self._pygit2.Tree)
+            tree[file_path].peel(self._pygit2.Blob).data.decode("utf-8")
+            hunks = repo.blame(file_path, newest_commit=commit_hash)
+        except (KeyError, ValueError, self._pygit2.GitError, UnicodeDecodeError):
+            return []
+        timestamps = []
+        author_times = {}
+        for hunk in hunks:
+            commit_id = hunk.final_commit_id
+            if commit_id not in author_times:
+                author_times[commit_id] = repo[commit_id].author.time
+            timestamps.extend([author_times[commit_id]] * hunk.lines_in_hunk)
+        return timestamps
+
+
+GIT_BACKENDS = {"subprocess": SubprocessBackend, "pygit2": Pygit2Backend}
+_backend_instances = {}
+
+
+def get_backend(name: str = "subprocess") -> GitBackend:
+    """Return the shared backend instance for a name from GIT_BACKENDS."""
+    if name not in GIT_BACKENDS:
+        raise ValueError(f"Unknown git backend {name!r}, choose from {list(GIT_BACKENDS)}")
+    if name not in _backend_instances:
+        _backend_instances[name] = GIT_BACKENDS[name]()
+    return _backend_instances[name]
+
+
+# ========================================
+# Sampling, file selection and blame
+# ========================================
+
+# Single shared pool for file-level blame — avoids spinning up/down per commit
+_file_executor = ThreadPoolExecutor(max_workers=32)
+
+
+def get_commit_list(
+    repo_path: str, pathspecs: list[str] | None = None, backend: str = "subprocess"
+) -> list[tuple[str, datetime]]:
+    """Get list of all commits with their dates, limited to commits touching `pathspecs`.
+
+    Cached until the repo's refs change, so a fetch that brings in commits is seen.
+    """
+    return _list_commits(repo_path, pathspecs, refs_fingerprint(repo_path), backend=backend)
+
+
+# Backends give identical results, so the backend name is left out of cache keys.
+# Always pass `backend=` as a keyword so that diskcache can ignore it.
+@memoize(ignore={"backend"})
+def _list_commits(
+    repo_path: str, pathspecs: list[str] | None, refs: str, backend: str = "subprocess"
+) -> list[tuple[str, datetime]]:
+    return [
+        (commit_hash, datetime.fromtimestamp(timestamp))
+        for commit_hash, timestamp in get_backend(backend).list_commits(repo_path, pathspecs)
+    ]
+
+
+GLOB_CHARS = set("*?[")
+
+
+def make_pathspecs(include: list[str] | None, exclude: list[str] | None) -> list[str] | None:
+    """Git pathspecs for include/exclude lists, e.g. ["pkg/a", ":(exclude)pkg/a/tests"]."""
+    if not include and not exclude:
+        return None
+    return [*(include or ["."]), *(f":(exclude){p}" for p in exclude or [])]
+
+
+def matches_path(file_path: str, pattern: str) -> bool:
+    """True if the path is the pattern, lies below it, or matches it as a glob."""
+    return (
+        file_path == pattern
+        or file_path.startswith(pattern + "/")
+        or (bool(GLOB_CHARS & set(pattern)) and fnmatch.fnmatchcase(file_path, pattern))
+    )
+
+
+def path_selected(file_path: str, include: list[str] | None, exclude: list[str] | None) -> bool:
+    if include and not any(matches_path(file_path, p) for p in include):
+        return False
+    return not (exclude and any(matches_path(file_path, p) for p in exclude))
+
+
+def subproject_of(file_path: str, subprojects: list[str] | None) -> str:
+    """The deepest subproject directory containing the path, or "" for none."""
+    matches = [s for s in subprojects or [] if matches_path(file_path, s)]
+    return max(matches, key=len) if matches else ""
+
+
+LINGUIST_ATTRS = ("linguist-generated", "linguist-vendored")
+
+
+def read_gitattributes(
+    repo_path: str, blob_hash: str, backend: str = "subprocess"
+) -> list[tuple[str, str, bool]]:
+    """Parse a .gitattributes blob into (pattern, attr, value) rules for linguist attrs."""
+    cache = get_cache()
+    cache_key = ("gitattributes_v1", blob_hash)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+    try:
+        content = get_backend(backend).read_blob(repo_path, blob_hash)
+    except (RuntimeError, UnicodeDecodeError):
+        content = ""
+    rules = []
+    for line in content.split("\n"):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        pattern, *attrs = line.split()
+        for attr in attrs:
+            value = not attr.startswith(("-", "!"))
+            name, _, raw = attr.lstrip("-!").partition("=")
+            if name in LINGUIST_ATTRS:
+                rules.append((pattern, name, value and raw.lower() not in ("false", "0")))
+    cache.set(cache_key, rules)
+    return rules
+
+
+@functools.lru_cache(maxsize=None)
+def wildmatch_regex(pattern: str) -> re.Pattern:
+    """Compile a gitattributes pattern like git's wildmatch.
+
+    `*`, `?` and `[...]` never match a `/`; only `**` spans directories:
+    `**/` matches zero or more leading directories, a trailing `/**` everything
+    below a directory and `a/**/b` zero or more directories in between.
+    """
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            out.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and (end := pattern.find("]", i + 2)) != -1:
+            body = pattern[i + 1 : end]
+            negate = body[:1] in ("!", "^")
+            body = re.escape(body[1:] if negate else body).replace("\\-", "-")
+            out.append(f"[^/{body}]" if negate else f"[{body}]")
+            i = end + 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile("".join(out) + r"\Z", re.DOTALL)
+
+
+def matches_gitattributes_pattern(file_path: str, base_dir: str, pattern: str) -> bool:
+    """Match a path against a .gitattributes pattern declared in base_dir."""
+    if base_dir:
+        if not file_path.startswith(base_dir + "/"):
+            return False
+        file_path = file_path[len(base_dir) + 1 :]
+    if "/" not in pattern.rstrip("/"):
+        # Patterns without a slash match the file name at any depth
+        return bool(wildmatch_regex(pattern).match(file_path.rsplit("/", 1)[-1]))
+    return bool(wildmatch_regex(pattern.lstrip("/")).match(file_path))
+
+
+def is_generated_or_vendored(file_path: str, attr_rules: list[tuple[str, str, str, bool]]) -> bool:
+    """Resolve linguist attrs for a path; later (deeper) rules win, like git."""
+    state = {}
+    for base_dir, pattern, attr, value in attr_rules:
+        if matches_gitattributes_pattern(file_path, base_dir, pattern):
+            state[attr] = value
+    return any(state.values())
+
+
+def skip_reason(
+    file_path: str,
+    size: int | None,
+    skip_globs: list[str] | None,
+    max_blob_bytes: int | None,
+    attr_rules: list[tuple[str, str, str, bool]],
+) -> str | None:
+    """Return why a file should not be blamed, or None to keep it."""
+    if size is None:
+        return "not a blob"
+    if max_blob_bytes and size > max_blob_bytes:
+        return "size"
+    if skip_globs:
+        file_name = file_path.rsplit("/", 1)[-1]
+        if any(
+            fnmatch.fnmatchcase(file_path, g) or fnmatch.fnmatchcase(file_name, g)
+            for g in skip_globs
+        ):
+            return "glob"
+    if attr_rules and is_generated_or_vendored(file_path, attr_rules):
+        return "gitattributes"
+    return None
+
+
+@memoize(ignore={"backend"}, name="get_tracked_files_v2")
+def get_tracked_files(
+    repo_path: str,
+    commit_hash: str,
+    extensions: list[str] | None = None,
+    skip_globs: list[str] | None = None,
+    max_blob_bytes: int | None = None,
+    honor_gitattributes: bool = True,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    backend: str = "subprocess",
+) -> list[tuple[str, str]]:
+    """Get list of (file_path, blob_hash) pairs at a specific commit, minus skipped files.
+
+    Plain `include` paths are passed down so that only those subtrees are listed.
+    """
+    paths = None
+    if include and not any(GLOB_CHARS & set(p) for p in include):
+        # Read only the included subtrees, plus the .gitattributes files above them
+        parents = {p[: i + 1] for p in include for i, c in enumerate(p) if c == "/"}
+        paths = [*include, *(f"{d}.gitattributes" for d in sorted(parents | {""}))]
+    # Overlapping paths can list an entry twice
+    tree = dict.fromkeys(get_backend(backend).list_tree(repo_path, commit_hash, paths))
+    entries = []
+    attr_files = []
+    for file_path, obj_type, blob_hash, size in tree:
+        size = size if obj_type == "blob" else None
+        if file_path.rsplit("/", 1)[-1] == ".gitattributes":
+            attr_files.append((file_path, blob_hash))
+        entries.append((file_path, blob_hash, size))
+
+    attr_rules = []
+    if honor_gitattributes:
+        # Shallow files first so that deeper .gitattributes override them
+        for attr_path, attr_blob in sorted(attr_files, key=lambda a: a[0].count("/")):
+            base_dir = attr_path.rpartition("/")[0]
+            for pattern, attr, value in read_gitattributes(repo_path, attr_blob, backend):
+                attr_rules.append((base_dir, pattern, attr, value))
+
+    results = []
+    for file_path, blob_hash, size in entries:
+        if extensions and not any(file_path.endswith(ext) for ext in extensions):
+            continue
+        if not path_selected(file_path, include, exclude):
+            continue
+        if skip_reason(file_path, size, skip_globs, max_blob_bytes, attr_rules):
+            continue
+        results.append((file_path, blob_hash))
+    return results
+
+
+# A blob whose blame timed out is tried once more with the same timeout, then skipped for good
+BLAME_TIMEOUT_ATTEMPTS = 2
+
+
+def get_blame_by_blob(
+    blob_hash: str,
+    repo_path: str,
+    commit_hash: str,
+    file_path: str,
+    timeout: float | None = None,
+    backend: str = "subprocess",
+) -> list[int] | None:
+    """Cache blame results by blob hash — identical blob = identical blame.
+
+    Timed-out blames return None. The timeouts of every blob are counted per
+    timeout value; after BLAME_TIMEOUT_ATTEMPTS of them the blob is skipped
+    without blaming it again.
+    """
+    cache = get_cache()
+    cache_key = ("blame_v1", blob_hash)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+    timeout_key = ("blame_timeouts_v1", blob_hash, timeout)
+    if cache.get(timeout_key, 0) >= BLAME_TIMEOUT_ATTEMPTS:
+        return None
+    result = get_backend(backend).blame(repo_path, commit_hash, file_path, timeout)
+    if result is None:
+        cache.incr(timeout_key)
+    else:
+        cache.set(cache_key, result)
+    return result
+
+
+@memoize()
+def sample_commits(
+    commits: list[tuple[str, datetime]], n_samples: int
+) -> list[tuple[str, datetime]]:
+    """Sample n commits evenly distributed across history."""
+    if len(commits) <= n_samples:
+        return commits
+    step = len(commits) / n_samples
+    indices = [int(i * step) for i in range(n_samples)]
+    # Always include the last commit
+    if indices[-1] != len(commits) - 1:
+        indices[-1] = len(commits) - 1
+    return [commits[i] for i in indices]
+
+
+def analyze_single_commit(
+    repo_path: str,
+    commit_hash: str,
+    extensions: list[str] | None,
+    skip_globs: list[str] | None = None,
+    max_blob_bytes: int | None = None,
+    honor_gitattributes: bool = True,
+    blame_timeout: float | None = None,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    subprojects: list[str] | None = None,
+    backend: str = "subprocess",
+) -> tuple[dict[str, list[int]], list[str]]:
+    """Analyze a single commit with blob-level blame dedup.
+
+    Returns the line timestamps of every blamed line, keyed by subproject
+    ("" for lines outside all subprojects), and the paths whose blame timed
+    out and were skipped.
+
+    Not memoized: the result is stored in the blame dataset, and the blame
+    cache by blob hash already makes analyzing a commit again cheap.
+    """
+    files = get_tracked_files(
+        repo_path,
+        commit_hash,
+        extensions,
+        skip_globs,
+        max_blob_bytes,
+        honor_gitattributes,
+        include,
+        exclude,
+        backend=backend,
+    )
+
+    def blame_file(file_blob: tuple[str, str]) -> list[int] | None:
+        file_path, blob_hash = file_blob
+        return get_blame_by_blob(blob_hash, repo_path, commit_hash, file_path, blame_timeout, backend)
+
+    results = {}
+    timed_out = []
+    file_futures = {_file_executor.submit(blame_file, fb): fb for fb in files}
+    for future in as_completed(file_futures):
+        timestamps = future.result()
+        file_path = file_futures[future][0]
+        if timestamps is None:
+            timed_out.append(file_path)
+            continue
+        results.setdefault(subproject_of(file_path, subprojects), []).extend(timestamps)
+    return results, sorted(timed_out)
+
+
+# Per repo, blame rows live in one hive-partitioned dataset with a partition per
+# analysis config (extensions, skip rules, subprojects), so every commit is stored
+# once however many runs sample it. New commits are staged as one chunk each and
+# `compact_dataset` writes them as a new sorted part file of the partition; once
+# there are more than MAX_PARTS parts, the smaller half is merged into one.
+DATASETS_DIR = CACHE_DIR / "blame-datasets"
+ROW_GROUP_SIZE = 256_000
+MAX_PARTS = 8
+BLAME_SCHEMA = {
+    "commit_hash": "Categorical",
+    "commit_date": "Int64",
+    "line_timestamp": "Int64",
+    "subproject": "String",
+}
+
+
+def _dataset_dir_for_config(repo_path, extensions, skip_rules=None, subprojects=None) -> Path:
+    """Dataset partition holding the blame rows of one repo under one analysis config.
+
+    The blame timeout is not part of the config: files that time out are left
+    out of a commit and listed in `skipped.json`, whatever the timeout was.
+    """
+    # The version tag changes whenever file selection rules change what gets blamed
+    rules = sorted((k, v) for k, v in (skip_rules or {}).items() if k != "blame_timeout")
+    key = repr(("selection_v3", extensions, rules, subprojects))
+    config_hash = hashlib.sha256(key.encode()).hexdigest()[:12]
+    out = DATASETS_DIR / Path(repo_path).name / f"config={config_hash}"
+    (out / "_staging").mkdir(parents=True, exist_ok=True)
+    return out
+
+
+def blame_schema() -> dict:
+    import polars as pl
+
+    return {name: getattr(pl, dtype) for name, dtype in BLAME_SCHEMA.items()}
+
+
+def write_commit_chunk(
+    out_path: Path,
+    commit_hash: str,
+    commit_timestamp: int,
+    line_timestamps: dict[str, list[int]],
+):
+    """Stage one commit's blame rows, tagged with their subproject, as a parquet chunk."""
+    import polars as pl
+
+    n_lines = sum(map(len, line_timestamps.values()))
+    pl.DataFrame(
+        {
+            "commit_hash": pl.repeat(commit_hash, n_lines, eager=True),
+            "commit_date": pl.repeat(commit_timestamp, n_lines, eager=True),
+            "line_timestamp": [t for group in line_timestamps.values() for t in group],
+            "subproject": [name for name, group in line_timestamps.items() for _ in group],
+        },
+        schema=blame_schema(),
+    ).write_parquet(out_path)
+
+
+def dataset_parts(dataset_dir: Path) -> list[Path]:
+    """Parquet files holding a partition's rows (`data.parquet` of older versions included)."""
+    return sorted(dataset_dir.glob("*.parquet"))
+
+
+def _scan_parts(paths: list[Path], predicate=None):
+    """Rows of `paths` matching `predicate`, keeping each commit's rows from the first file that has it.
+
+    Files never share a commit unless a compaction was interrupted between
+    writing a part and removing its sources; this keeps one copy either way.
+    The predicate is applied to every file before that, so it reaches the
+    parquet reader.
+    """
+    import polars as pl
+
+    scans = [pl.scan_parquet(path).select(list(BLAME_SCHEMA)) for path in paths]
+    if predicate is not None:
+        scans = [scan.filter(predicate) for scan in scans]
+    return (
+        pl.concat(
+            [
+                scan.cast(blame_schema()).with_columns(source=pl.lit(i))
+                for i, scan in enumerate(scans)
+            ]
+        )
+        .filter(pl.col("source") == pl.col("source").min().over("commit_hash"))
+        .drop("source")
+    )
+
+
+def _write_part(dataset_dir: Path, rows) -> Path | None:
+    """Sink `rows` sorted by commit date, in row groups with statistics, as a new part."""
+    import polars as pl
+
+    path = dataset_dir / f"part-{time.time_ns():x}.parquet"
+    tmp_path = path.with_name(path.name + ".tmp")
+    rows.sort(["commit_date", "commit_hash"]).sink_parquet(
+        tmp_path, row_group_size=ROW_GROUP_SIZE, statistics=True
+    )
+    if not pl.scan_parquet(tmp_path).select(pl.len()).collect().item():
+        tmp_path.unlink()
+        return None
+    os.replace(tmp_path, path)
+    return path
+
+
+def compact_dataset(dataset_dir: Path, line_counts: dict[str, int] | None = None) -> dict[str, int]:
+    """Add staged chunks to the partition as a new part, one copy per commit.
+
+    Only the staged rows are sorted and written, so readers can skip
+    everything outside the commits they select by row group statistics.
+    Commits already in the dataset win over staged copies. `line_counts` holds
+    the line count of every commit analyzed by the caller, including commits
+    without lines, which stage no chunk; staged chunks not in it (from an
+    interrupted run or an imported bundle) are counted from their rows.
+    Returns the line count of every stored commit, as recorded in `commits.json`.
+    """
+    import polars as pl
+
+    commits_path = dataset_dir / "commits.json"
+    commits = json.loads(commits_path.read_text()) if commits_path.exists() else {}
+    line_counts = line_counts or {}
+    staged = sorted((dataset_dir / "_staging").glob("*.parquet"))
+    if not staged and line_counts.keys() <= commits.keys():
+        return commits
+
+    if staged:
+        _write_part(
+            dataset_dir,
+            _scan_parts(staged, ~pl.col("commit_hash").is_in(list(commits))),
+        )
+        uncounted = [path for path in staged if path.stem not in line_counts]
+        if uncounted:
+            counts = _scan_parts(uncounted).group_by("commit_hash").len().collect()
+            for commit_hash, n_lines in counts.iter_rows():
+                commits.setdefault(commit_hash, n_lines)
+    for commit_hash, n_lines in line_counts.items():
+        commits.setdefault(commit_hash, n_lines)
+
+    parts = dataset_parts(dataset_dir)
+    if len(parts) > MAX_PARTS:
+        smallest = sorted(parts, key=lambda path: path.stat().st_size)[: max(2, len(parts) // 2)]
+        _write_part(dataset_dir, _scan_parts(smallest))
+        for path in smallest:
+            path.unlink()
+
+    tmp_path = commits_path.with_name(commits_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(commits, indent=2, sort_keys=True))
+    os.replace(tmp_path, commits_path)
+    for path in staged:
+        path.unlink()
+    return commits
+
+
+def peak_memory_mb() -> float | None:
+    """Peak resident set size of this process in MB, where the platform reports it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# Rough in-memory cost of one blamed line while a commit is in flight: the
+# per-file blame lists, the merged list and its parquet conversion.
+BYTES_PER_LINE = 120
+
+
+def collect_blame_data(
+    repo_path: str,
+    sampled_commits: list[tuple[str, datetime]],
+    extensions: list[str] | None,
+    progress_bar=None,
+    is_script: bool = False,
+    max_workers: int = 32,
+    skip_rules: dict | None = None,
+    backend: str = "subprocess",
+    memory_budget_mb: int = 0,
+    subprojects: list[str] | None = None,
+) -> Path:
+    """Collect raw blame data into the repo's dataset and return its partition.
+
+    Commits already stored under the same config are not analyzed again; new
+    ones are staged as one parquet chunk each and compacted into the dataset
+    at the end. Read the sampled rows back with `load_blame_data`.
+
+    `skip_rules` holds the keyword arguments for file skipping (skip_globs,
+    max_blob_bytes, honor_gitattributes, blame_timeout). Files whose blame
+    timed out are listed in `skipped.json` in the partition.
+
+    A commit with timed-out blames is stored without those files, which are
+    listed under the commit in `skipped.json`.
+
+    Commits are submitted through a bounded window rather than all at once.
+    Each worker writes its own chunk and only returns a row count, so results
+    are released as soon as they are persisted. With `memory_budget_mb`, the
+    window shrinks so that the largest commit seen so far times the number of
+    commits in flight stays within the budget.
+
+    With `subprojects`, every row records the subproject directory its file belongs to.
+    """
+    skip_rules = skip_rules or {}
+    dataset_dir = _dataset_dir_for_config(repo_path, extensions, skip_rules, subprojects)
+    # Picks up chunks staged by an interrupted run
+    stored = compact_dataset(dataset_dir)
+    skipped_path = dataset_dir / "skipped.json"
+    skipped = json.loads(skipped_path.read_text()) if skipped_path.exists() else {}
+    total = len(sampled_commits)
+    done = 0
+    budget_bytes = memory_budget_mb * 1024 * 1024
+    max_lines_seen = 0
+    line_counts = {}
+
+    def analyze_and_write(commit_hash: str, commit_date: datetime) -> tuple[int, list[str]]:
+        if commit_hash in stored:
+            return stored[commit_hash], skipped.get(commit_hash, [])
+        out_path = dataset_dir / "_staging" / f"{commit_hash}.parquet"
+        line_timestamps, timed_out = analyze_single_commit(
+            str(repo_path),
+            commit_hash,
+            extensions,
+            **skip_rules,
+            subprojects=subprojects,
+            backend=backend,
+        )
+        n_lines = sum(map(len, line_timestamps.values()))
+        # Commits without lines are only recorded by their count
+        if n_lines:
+            write_commit_chunk(out_path, commit_hash, int(commit_date.timestamp()), line_timestamps)
+        return n_lines, timed_out
+
+    def window_size() -> int:
+        if not budget_bytes:
+            return max_workers
+        if not max_lines_seen:
+            # No size estimate yet: a single commit until the first one reports back
+            return 1
+        fits = budget_bytes // (max_lines_seen * BYTES_PER_LINE)
+        return max(1, min(max_workers, fits))
+
+    todo = iter(sampled_commits)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while len(in_flight) < window_size():
+                commit = next(todo, None)
+                if commit is None:
+                    break
+                in_flight[executor.submit(analyze_and_write, *commit)] = commit[0]
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                commit_hash = in_flight.pop(future)
+                n_lines, timed_out = future.result()
+                max_lines_seen = max(max_lines_seen, n_lines)
+                if timed_out:
+                    skipped[commit_hash] = timed_out
+                line_counts[commit_hash] = n_lines
+                done += 1
+                if progress_bar:
+                    progress_bar.update(title=f"Analyzed {commit_hash[:8]}...")
+                if is_script:
+                    print(f"  [{done}/{total}] Analyzed {commit_hash[:8]}")
+
+    skipped_path.write_text(json.dumps(skipped, indent=2))
+    compact_dataset(dataset_dir, line_counts)
+    run_skipped = [skipped[h] for h, _ in sampled_commits if h in skipped]
+    if run_skipped and is_script:
+        n_files = sum(len(paths) for paths in run_skipped)
+        print(
+            f"  Skipped {n_files} file blames in {len(run_skipped)} commits that exceeded "
+            "the timeout, see skipped.json"
+        )
+    peak = peak_memory_mb()
+    if is_script and peak is not None:
+        print(f"  Peak memory: {peak:.0f} MB")
+    return dataset_dir
+
+
+# ========================================
+# Aggregation
+# ========================================
+
+
+def load_blame_data(dataset_dir: Path, commits: list[tuple[str, datetime]]):
+    """Read the rows of `commits` from a dataset partition as a (commit_date, line_timestamp, subproject) frame.
+
+    The date range filter lets the parquet reader skip row groups of every
+    part by their statistics; the hash filter then picks the exact commits.
+    """
+    import polars as pl
+
+    parts = dataset_parts(dataset_dir)
+    if parts and commits:
+        timestamps = [int(commit_date.timestamp()) for _, commit_date in commits]
+        return (
+            _scan_parts(
+                parts,
+                pl.col("commit_date").is_between(min(timestamps), max(timestamps))
+                & pl.col("commit_hash").is_in([commit_hash for commit_hash, _ in commits]),
+            )
+            .select(
+                pl.from_epoch("commit_date", time_unit="s").alias("commit_date"),
+                "line_timestamp",
+                "subproject",
+            )
+            .collect()
+        )
+    return pl.DataFrame({
+        "commit_date": pl.Series([], dtype=pl.Datetime),
+        "line_timestamp": pl.Series([], dtype=pl.Int64),
+        "subproject": pl.Series([], dtype=pl.Utf8),
+    })
+
+
+def aggregate_by_period(raw_df, granularity: str = "Quarter"):
+    """Count lines per (commit_date, period) where period is the year or quarter added."""
+    import polars as pl
+
+    # Vectorized period derivation using native Polars dt ops
+    ts_col = pl.from_epoch(pl.col("line_timestamp"), time_unit="s")
+
+    if granularity == "Year":
+        period_expr = ts_col.dt.year().cast(pl.Utf8).alias("period")
+    else:  # Quarter
+        period_expr = pl.concat_str(
+            ts_col.dt.year().cast(pl.Utf8),
+            pl.lit("-Q"),
+            ((ts_col.dt.month() - 1) // 3 + 1).cast(pl.Utf8),
+        ).alias("period")
+
+    return (
+        raw_df.with_columns(period_expr)
+        .group_by(["commit_date", "period"])
+        .len()
+        .rename({"len": "line_count"})
+        .sort(["commit_date", "period"])
+    )
+
+
+# ========================================
+# Versions
+# ========================================
+
+VERSION_RE = re.compile(r"^v?(0|[1-9]\d*)\.(0|[1-9]\d*)\.0$")
+
+
+def get_version_rows(
+    repo_path: Path, source: str, repo_name: str, pypi_name: str = ""
+) -> list[dict]:
+    """Minor/major release dates from git tags or PyPI, as {"version", "datetime"} rows."""
+    version_rows = []
+
+    if source == "git tags":
+        result = subprocess.run(
+            [
+                "git",
+                "for-each-ref",
+                "--sort=creatordate",
+                "--format=%(refname:short)|%(creatordate:unix)",
+                "refs/tags",
+            ],
+            cwd=repo_path,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+        )
+        for line in result.stdout.strip().split("\n"):
+            if line and VERSION_RE.match(line.split("|")[0]):
+                tag, ts = line.split("|", 1)
+                if ts.strip():
+                    version_rows.append(
+                        {"version": tag, "datetime": datetime.fromtimestamp(int(ts))}
+                    )
+
+    elif source == "pypi":
+        import httpx
+        from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+
+        @retry(
+            stop=stop_after_attempt(3),
+            wait=wait_exponential(multiplier=1, min=1, max=10),
+            retry=retry_if_exception_type((httpx.ConnectError, httpx.TimeoutException)),
+        )
+        def fetch_pypi(name):
+            return httpx.get(f"https://pypi.org/pypi/{name}/json")
+
+        try:
+            resp = fetch_pypi(pypi_name or repo_name)
+            if resp.status_code == 200:
+                for key, value in resp.json().get("releases", {}).items():
+                    if key.endswith(".0") and key != "0.0.0" and len(value) > 0:
+                        version_rows.append(
+                            {
+                                "version": key,
+                                "datetime": datetime.fromisoformat(value[0]["upload_time"]),
+                            }
+                        )
+        except Exception:
+            pass
+    return version_rows
+
+
+# ========================================
+# Charts
+# ========================================
+
+CHART_TITLE = "Code Archaeology: Lines of Code by Period Added"
+
+
+def version_layers(version_rows: list[dict]):
+    """Dashed release rules and their labels, or (None, None) without versions."""
+    if not version_rows:
+        return None, None
+    import altair as alt
+    import polars as pl
+
+    df_versions = pl.DataFrame(version_rows, schema={"version": pl.Utf8, "datetime": pl.Datetime})
+    base_chart = alt.Chart(df_versions)
+
+    date_lines = base_chart.mark_rule(strokeDash=[5, 5]).encode(
+        x=alt.X("datetime:T", title="Date"), tooltip=["version:N", "datetime:T"]
+    )
+
+    date_text = base_chart.mark_text(angle=270, align="left", dx=15, dy=0).encode(
+        x="datetime:T", y=alt.value(10), text="version:N"
+    )
+    return date_lines, date_text
+
+
+def area_chart(df, granularity: str = "Quarter", invert: bool = False):
+    """Stacked area chart of line counts per period added."""
+    import altair as alt
+
+    alt.data_transformers.disable_max_rows()
+    color_title = "Year Added" if granularity == "Year" else "Quarter Added"
+    sort_order = "descending" if invert else "ascending"
+
+    return (
+        alt.Chart(df)
+        .mark_area()
+        .encode(
+            x=alt.X("commit_date:T", title="Date"),
+            y=alt.Y("line_count:Q", title="Lines of Code"),
+            color=alt.Color(
+                "period:O",
+                scale=alt.Scale(scheme="viridis"),
+                title=color_title,
+            ),
+            order=alt.Order("period:O", sort=sort_order),
+            tooltip=["commit_date:T", "period:O", "line_count:Q"],
+        )
+    )
+
+
+def with_title(chart):
+    return chart.properties(title=CHART_TITLE, width=800, height=500)
+
+
+def export_charts(repo_name: str, out, chart, date_lines=None, date_text=None) -> list[Path]:
+    """Write `<repo>-clean.json` from `out` and, with versions, `<repo>-versioned.json`."""
+    CHARTS_DIR.mkdir(exist_ok=True)
+
+    clean_path = CHARTS_DIR / (repo_name + "-clean.json")
+    clean_path.write_text(out.to_json())
+    written = [clean_path]
+
+    versioned_path = CHARTS_DIR / (repo_name + "-versioned.json")
+    if date_lines is not None:
+        versioned_chart = with_title(chart + date_lines + date_text).to_dict()
+        # Same output as alt.Chart.from_dict(...).to_json(), without validating twice
+        versioned_path.write_text(json.dumps(versioned_chart, indent=2, sort_keys=True))
+        written.append(versioned_path)
+    return written
+
+
+def tile_windows(
+    commits: list[tuple[str, datetime]], n_samples: int
+) -> list[tuple[str, datetime]]:
+    """Sample up to n commits within every calendar year (UTC) of history."""
+    windows = {}
+    for commit in commits:
+        year = datetime.fromtimestamp(commit[1].timestamp(), timezone.utc).year
+        windows.setdefault(year, []).append(commit)
+    return [c for window in windows.values() for c in sample_commits(window, n_samples)]
+
+
+def export_tiles(repo_name: str, df) -> list[Path]:
+    """Write the aggregated rows of each year to `tiles/<repo>/<year>.json`, plus an index.
+
+    The exported chart is the coarse level covering all of history; tiles add
+    denser samples that the frontend loads only for the years in view.
+    """
+    import polars as pl
+
+    tile_dir = TILES_DIR / repo_name
+    tile_dir.mkdir(parents=True, exist_ok=True)
+    for stale in tile_dir.glob("*.json"):
+        stale.unlink()
+
+    rows = df.with_columns(
+        year=pl.col("commit_date").dt.year(),
+        commit_date=pl.col("commit_date").dt.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+    tiles, written = [], []
+    for (year,), tile in rows.partition_by("year", as_dict=True, include_key=False).items():
+        path = tile_dir / f"{year}.json"
+        path.write_text(json.dumps(tile.to_dicts()))
+        written.append(path)
+        tiles.append({
+            "start": f"{year}-01-01T00:00:00",
+            "end": f"{year + 1}-01-01T00:00:00",
+            "url": path.name,
+            "commits": tile["commit_date"].n_unique(),
+        })
+    index_path = tile_dir / "index.json"
+    index_path.write_text(json.dumps({"tiles": sorted(tiles, key=lambda t: t["start"])}, indent=2))
+    return [index_path, *written]
+
+
+def subproject_slug(subproject: str) -> str:
+    """Chart name suffix for a subproject directory: `pkg/sub` -> `pkg-sub`."""
+    return subproject.strip("/").replace("/", "-")
+
+
+def scope_slug(path: str) -> str:
+    """Chart name suffix for an include/exclude path or glob: `src/*.py` -> `src-.py`."""
+    return re.sub(r"[^A-Za-z0-9._]+", "-", path).strip("-")
+
+
+def export_subproject_charts(
+    repo_name: str, raw_df, subprojects: list[str], granularity: str, version_rows=None
+) -> list[Path]:
+    """Write one clean/versioned chart pair per subproject, named `<repo>-<slug>`."""
+    import polars as pl
+
+    date_lines, date_text = version_layers(version_rows or [])
+    written = []
+    for subproject in subprojects:
+        df = aggregate_by_period(raw_df.filter(pl.col("subproject") == subproject), granularity)
+        chart = area_chart(df, granularity)
+        written += export_charts(
+            f"{repo_name}-{subproject_slug(subproject)}",
+            with_title(chart),
+            chart,
+            date_lines,
+            date_text,
+        )
+    return written
+
+
+# ========================================
+# Pipeline
+# ========================================
+
+
+def run(params: RepoParams, progress_bar=None) -> list[Path]:
+    """Run the full pipeline for one repo and return the chart files written.
+
+    `progress_bar` gets its `total` set once commits are sampled and one
+    `update()` per analyzed commit, like the notebook's progress bar.
+    """
+    repo_url = resolve_repo_url(params.repo)
+    print(f"Cloning/updating {repo_url}...")
+    repo_path = clone_or_update_repo(repo_url)
+    if params.prepare:
+        report = prepare_repo(repo_path, params.extensions, benchmark=params.benchmark_prepare)
+        if not report["prepared"]:
+            print("Repository indexes are up to date")
+        elif report["before"] is not None:
+            print(
+                f"Prepared repository indexes: blame {report['before']:.2f}s -> "
+                f"{report['after']:.2f}s on the largest files"
+            )
+        else:
+            print("Prepared repository indexes")
+
+    all_commits = get_commit_list(str(repo_path), params.pathspecs, backend=params.backend)
+    sampled = sample_commits(all_commits, params.samples)
+    print(f"Found {len(all_commits)} commits, sampling {len(sampled)} for analysis")
+    if progress_bar is not None:
+        progress_bar.total = len(sampled)
+
+    dataset_dir = collect_blame_data(
+        repo_path,
+        sampled,
+        params.extensions,
+        progress_bar=progress_bar,
+        is_script=True,
+        skip_rules=params.skip_rules,
+        backend=params.backend,
+        memory_budget_mb=params.memory_budget_mb,
+        subprojects=params.subproject_paths,
+    )
+    raw_df = load_blame_data(dataset_dir, sampled)
+    df = aggregate_by_period(raw_df, params.granularity)
+
+    version_rows = get_version_rows(
+        repo_path, params.version_source, params.repo_name, params.pypi_name
+    )
+    chart = area_chart(df, params.granularity)
+    date_lines, date_text = version_layers(version_rows)
+    written = export_charts(params.chart_name, with_title(chart), chart, date_lines, date_text)
+    written += export_subproject_charts(
+        params.chart_name, raw_df, params.subproject_paths or [], params.granularity, version_rows
+    )
+    for path in written:
+        print(f"Wrote {path}")
+
+    if params.tile_samples:
+        tile_commits = tile_windows(all_commits, params.tile_samples)
+        print(f"Sampling {len(tile_commits)} commits for detail tiles")
+        tile_dataset_dir = collect_blame_data(
+            repo_path,
+            tile_commits,
+            params.extensions,
+            is_script=True,
+            skip_rules=params.skip_rules,
+            backend=params.backend,
+            memory_budget_mb=params.memory_budget_mb,
+            subprojects=params.subproject_paths,
+        )
+        tiles = export_tiles(
+            params.chart_name,
+            aggregate_by_period(
+                load_blame_data(tile_dataset_dir, tile_commits), params.granularity
+            ),
+        )
+        print(f"Wrote {len(tiles) - 1} tiles to {tiles[0].parent}")
+        written += tiles
+    return written
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """CLI flags generated from the RepoParams fields."""
+    parser = argparse.ArgumentParser(
+        prog="archaeology.py",
+        description="Chart how the code in a git repository ages over time.",
+    )
+    for field in dataclasses.fields(RepoParams):
+        flags = [f"--{field.name.replace('_', '-')}"]
+        if "_" in field.name:
+            flags.append(f"--{field.name}")
+        required = field.default is dataclasses.MISSING
+        parser.add_argument(
+            *flags,
+            dest=field.name,
+            # bool fields stay strings, __post_init__ parses them
+            type=field.type if field.type in (int, float) else None,
+            required=required,
+            default=None if required else field.default,
+            help=field.metadata["help"] + ("" if required else f" (default: {field.default})"),
+        )
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    args = build_parser().parse_args(argv)
+    run(RepoParams(**vars(args)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
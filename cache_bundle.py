@@ -0,0 +1,280 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "diskcache==5.6.3",
+# ]
+# ///
+
+"""Export and import portable cache bundles for one repo.
+
+A bundle is a single SQLite file holding the blob-level caches (blame and
+.gitattributes results, keyed by blob hash) for every blob reachable in the
+repo, plus the repo's compacted blame datasets with the per-commit results. Values are stored
+zlib-compressed, and a SHA-256 over all rows is recorded in the bundle and
+verified before anything is imported.
+
+Importing merges into the local cache: cache entries and commits that already
+exist are left alone, so seeding a fresh worker never redoes or overwrites work.
+
+    uv run cache_bundle.py export --repo marimo-team/marimo --output marimo.sqlite
+    uv run cache_bundle.py import marimo.sqlite
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import subprocess
+import sys
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+from archaeology import (
+    DATASETS_DIR,
+    compact_dataset,
+    dataset_parts,
+    get_cache,
+    get_cached_repo_path,
+    resolve_repo_url,
+)
+
+BUNDLE_FORMAT = "gitcharts-cache-bundle"
+# Version 2 stores dataset partitions instead of version 1's per-run chunk directories,
+# version 3 every part file of a partition instead of a single data.parquet
+BUNDLE_VERSION = 3
+# Cache entries keyed by (kind, blob_hash) that are valid for any repo containing the blob
+BLOB_CACHE_KINDS = ("blame_v1", "gitattributes_v1")
+# Files of a dataset partition besides its parquet parts; both map commit hashes to values
+DATASET_JSON_FILES = ("commits.json", "skipped.json")
+# Partition directories are named after a truncated SHA-256 of the analysis config
+PARTITION_PATTERN = re.compile(r"config=[0-9a-f]{12}")
+PART_PATTERN = re.compile(r"(data|part-[0-9a-f]+)\.parquet")
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE blobs (
+    kind TEXT NOT NULL, blob_hash TEXT NOT NULL, value BLOB NOT NULL,
+    PRIMARY KEY (kind, blob_hash)
+) WITHOUT ROWID;
+CREATE TABLE chunks (
+    run TEXT NOT NULL, name TEXT NOT NULL, data BLOB NOT NULL,
+    PRIMARY KEY (run, name)
+) WITHOUT ROWID;
+"""
+
+
+def bundle_checksum(conn: sqlite3.Connection) -> str:
+    """SHA-256 over every blob and chunk row, in key order."""
+    digest = hashlib.sha256()
+    for table, columns in (("blobs", "kind, blob_hash, value"), ("chunks", "run, name, data")):
+        for key_a, key_b, data in conn.execute(f"SELECT {columns} FROM {table} ORDER BY 1, 2"):
+            digest.update(f"{table}\0{key_a}\0{key_b}\0{len(data)}\0".encode())
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def reachable_objects(repo_path: Path) -> set[str]:
+    """Hashes of all commits, trees and blobs reachable from the repo's refs."""
+    output = subprocess.run(
+        ["git", "rev-list", "--objects", "--all"],
+        cwd=repo_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    # Lines are `<hash> [<path>]`; hashes are 40 or 64 characters depending on the object format
+    return {line.split(maxsplit=1)[0] for line in output.splitlines() if line}
+
+
+def repo_partitions(repo_path: Path) -> list[Path]:
+    """The repo's dataset partitions, one per analysis config."""
+    return sorted((DATASETS_DIR / repo_path.name).glob("config=*"))
+
+
+def dataset_partition(run: str) -> Path:
+    """Local partition directory for a bundle's `<repo>/config=<hash>` dataset name.
+
+    Bundles may come from elsewhere, so anything that could point outside
+    DATASETS_DIR is refused.
+    """
+    parts = run.split("/")
+    if (
+        len(parts) != 2
+        or parts[0] in ("", ".", "..")
+        or "\\" in parts[0]
+        or not PARTITION_PATTERN.fullmatch(parts[1])
+    ):
+        raise ValueError(f"Invalid dataset name in bundle: {run!r}")
+    return DATASETS_DIR / parts[0] / parts[1]
+
+
+def export_bundle(repo: str, output: Path) -> dict:
+    """Write the cache entries and blame datasets of a downloaded repo to `output`."""
+    repo_url = resolve_repo_url(repo)
+    repo_path = get_cached_repo_path(repo_url)
+    if not repo_path.exists():
+        raise FileNotFoundError(f"{repo_url} has not been downloaded to {repo_path}")
+    objects = reachable_objects(repo_path)
+
+    output.unlink(missing_ok=True)
+    conn = sqlite3.connect(output)
+    conn.executescript(SCHEMA)
+    counts = {"blobs": 0, "datasets": 0}
+    cache = get_cache()
+    rows = []
+    for key in cache.iterkeys():
+        if (
+            isinstance(key, tuple)
+            and len(key) == 2
+            and key[0] in BLOB_CACHE_KINDS
+            and key[1] in objects
+        ):
+            value = cache.get(key)
+            if value is not None:
+                rows.append((key[0], key[1], zlib.compress(json.dumps(value).encode())))
+        if len(rows) >= 10_000:
+            conn.executemany("INSERT INTO blobs VALUES (?, ?, ?)", rows)
+            counts["blobs"] += len(rows)
+            rows = []
+    conn.executemany("INSERT INTO blobs VALUES (?, ?, ?)", rows)
+    counts["blobs"] += len(rows)
+
+    for partition in repo_partitions(repo_path):
+        compact_dataset(partition)
+        files = dataset_parts(partition) + [partition / name for name in DATASET_JSON_FILES]
+        for path in files:
+            if path.exists():
+                conn.execute(
+                    "INSERT INTO chunks VALUES (?, ?, ?)",
+                    (f"{repo_path.name}/{partition.name}", path.name, path.read_bytes()),
+                )
+        counts["datasets"] += 1
+
+    meta = {
+        "format": BUNDLE_FORMAT,
+        "version": str(BUNDLE_VERSION),
+        "repo_url": repo_url,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "checksum": bundle_checksum(conn),
+    }
+    conn.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    return counts
+
+
+def read_meta(conn: sqlite3.Connection) -> dict:
+    """Bundle metadata, after checking the format, version and checksum."""
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"Not a cache bundle: {e}") from e
+    if meta.get("format") != BUNDLE_FORMAT:
+        raise ValueError("Not a cache bundle")
+    if int(meta.get("version", 0)) > BUNDLE_VERSION:
+        raise ValueError(
+            f"Bundle version {meta['version']} is newer than supported version {BUNDLE_VERSION}"
+        )
+    if bundle_checksum(conn) != meta.get("checksum"):
+        raise ValueError("Bundle checksum mismatch, the file is corrupt or incomplete")
+    return meta
+
+
+def import_bundle(bundle: Path) -> dict:
+    """Merge a bundle into the local cache, keeping every entry that already exists."""
+    conn = sqlite3.connect(f"file:{bundle}?mode=ro", uri=True)
+    meta = read_meta(conn)
+    counts = {"repo_url": meta["repo_url"], "blobs": 0, "commits": 0, "present": 0}
+    if int(meta["version"]) >= 2:
+        # Validated up front so a bad bundle is refused before anything is imported
+        for run, name in conn.execute("SELECT run, name FROM chunks"):
+            dataset_partition(run)
+            if name not in DATASET_JSON_FILES and not PART_PATTERN.fullmatch(name):
+                raise ValueError(f"Invalid dataset file in bundle: {name!r}")
+
+    cache = get_cache()
+    for kind, blob_hash, value in conn.execute("SELECT kind, blob_hash, value FROM blobs"):
+        if kind not in BLOB_CACHE_KINDS:
+            continue
+        value = json.loads(zlib.decompress(value))
+        if kind == "gitattributes_v1":
+            value = [tuple(rule) for rule in value]
+        if cache.add((kind, blob_hash), value):
+            counts["blobs"] += 1
+        else:
+            counts["present"] += 1
+
+    if int(meta["version"]) < 2:
+        print(f"{bundle} has per-run chunks from an older layout, only its cache entries are used")
+        conn.close()
+        return counts
+
+    local_commits, bundle_json = {}, {}
+    for run, name, data in conn.execute("SELECT run, name, data FROM chunks ORDER BY run, name"):
+        partition = dataset_partition(run)
+        if partition not in local_commits:
+            (partition / "_staging").mkdir(parents=True, exist_ok=True)
+            local_commits[partition] = set(compact_dataset(partition))
+            bundle_json[partition] = {}
+        if name in DATASET_JSON_FILES:
+            bundle_json[partition][name] = json.loads(data)
+        else:
+            # Staged like new chunks, so compaction keeps local commits over imported ones
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            (partition / "_staging" / f"import-{digest}.parquet").write_bytes(data)
+
+    for partition, before in local_commits.items():
+        # The bundle's line counts also record its commits without lines, which have no rows
+        stored = compact_dataset(partition, bundle_json[partition].get("commits.json"))
+        counts["commits"] += len(set(stored) - before)
+        skipped_path = partition / "skipped.json"
+        skipped = {
+            commit_hash: paths
+            for commit_hash, paths in bundle_json[partition].get("skipped.json", {}).items()
+            if commit_hash not in stored
+        }
+        if skipped_path.exists():
+            skipped.update(json.loads(skipped_path.read_text()))
+        skipped_path.write_text(json.dumps(skipped, indent=2))
+    conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Write a bundle for a downloaded repo")
+    export_parser.add_argument("--repo", required=True, help="Repository URL or owner/name")
+    export_parser.add_argument("--output", type=Path, help="Bundle path (default: <repo>.sqlite)")
+    import_parser = commands.add_parser("import", help="Merge bundles into the local cache")
+    import_parser.add_argument("bundles", type=Path, nargs="+")
+    args = parser.parse_args()
+    try:
+        run_command(args)
+    except (FileNotFoundError, ValueError) as e:
+        sys.exit(f"ERROR: {e}")
+
+
+def run_command(args: argparse.Namespace):
+    if args.command == "export":
+        output = args.output or Path(get_cached_repo_path(resolve_repo_url(args.repo)).name + ".sqlite")
+        counts = export_bundle(args.repo, output)
+        size_mb = output.stat().st_size / 1024 / 1024
+        print(
+            f"Wrote {output} ({size_mb:.1f} MB): "
+            f"{counts['blobs']} cached blobs, {counts['datasets']} blame datasets"
+        )
+    else:
+        for bundle in args.bundles:
+            counts = import_bundle(bundle)
+            print(
+                f"Imported {bundle} ({counts['repo_url']}): {counts['blobs']} cached blobs "
+                f"({counts['present']} already present), {counts['commits']} new commits"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "polars==1.35.2",
+#     "pyyaml>=6.0",
+# ]
+# ///
+
+"""Code survival analytics for every repo in repos.yml.
+
+Works on the aggregated (commit_date, period, line_count) table that is embedded
+in the exported charts, so no raw blame rows are ever read. For every repo and
+cohort (the year or quarter a line was added) it computes:
+
+- survival curves: the fraction of a cohort's peak line count still present
+- half-life: years after the cohort ended until half of its peak is gone
+- turnover per release: the share of lines present at a release that were
+  removed before the next one
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import polars as pl
+import yaml
+
+from archaeology import RepoParams
+
+YEAR = 365.25 * 24 * 3600
+
+
+def read_chart_tables(chart_path: Path) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """Return the (commit_date, period, line_count) and (version, datetime) tables of a chart."""
+    datasets = json.loads(chart_path.read_text()).get("datasets", {}).values()
+    lines = pl.DataFrame(schema={"commit_date": pl.Utf8, "period": pl.Utf8, "line_count": pl.Int64})
+    versions = pl.DataFrame(schema={"version": pl.Utf8, "datetime": pl.Utf8})
+    for rows in datasets:
+        if rows and "line_count" in rows[0]:
+            lines = pl.DataFrame(rows).select(lines.columns).cast(lines.schema)
+        elif rows and "version" in rows[0]:
+            versions = pl.DataFrame(rows).select(versions.columns).cast(versions.schema)
+    return lines, versions
+
+
+def load_cohorts(
+    names: list[str], charts_dir: Path = Path("charts")
+) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """Stack the aggregated tables of all repos into one frame with a `repo` column.
+
+    Prefers the versioned chart (it carries release dates) and falls back to the clean one.
+    """
+    line_frames, version_frames = [], []
+    for name in names:
+        for variant in ("versioned", "clean"):
+            chart_path = charts_dir / f"{name}-{variant}.json"
+            if chart_path.exists():
+                lines, versions = read_chart_tables(chart_path)
+                line_frames.append(lines.with_columns(repo=pl.lit(name)))
+                version_frames.append(versions.with_columns(repo=pl.lit(name)))
+                break
+        else:
+            print(f"WARNING: no chart found for {name}, skipping")
+
+    lines = pl.concat(line_frames) if line_frames else pl.DataFrame(
+        schema={"commit_date": pl.Utf8, "period": pl.Utf8, "line_count": pl.Int64, "repo": pl.Utf8}
+    )
+    versions = pl.concat(version_frames) if version_frames else pl.DataFrame(
+        schema={"version": pl.Utf8, "datetime": pl.Utf8, "repo": pl.Utf8}
+    )
+    return (
+        lines.with_columns(pl.col("commit_date").str.to_datetime()),
+        versions.with_columns(pl.col("datetime").str.to_datetime()),
+    )
+
+
+def to_cohorts(lines: pl.DataFrame, granularity: str = "year") -> pl.DataFrame:
+    """Add `cohort`, `cohort_end` and `age_years` columns, regrouping quarters into years if asked."""
+    if granularity == "year":
+        lines = (
+            lines.with_columns(pl.col("period").str.slice(0, 4))
+            .group_by(["repo", "commit_date", "period"])
+            .agg(pl.col("line_count").sum())
+        )
+        start = pl.date(pl.col("cohort").cast(pl.Int32), 1, 1)
+        step = "1y"
+    else:
+        quarterly = lines.filter(pl.col("period").str.contains("-Q"))
+        for name in sorted(set(lines["repo"]) - set(quarterly["repo"])):
+            print(f"WARNING: {name} chart has no quarterly periods, skipping")
+        lines = quarterly
+        start = pl.date(
+            pl.col("cohort").str.slice(0, 4).cast(pl.Int32),
+            (pl.col("cohort").str.slice(-1).cast(pl.Int32) - 1) * 3 + 1,
+            1,
+        )
+        step = "1q"
+    return (
+        lines.rename({"period": "cohort"})
+        .with_columns(cohort_end=start.dt.offset_by(step).cast(pl.Datetime("us")))
+        .with_columns(
+            age_years=(
+                (pl.col("commit_date") - pl.col("cohort_end")).dt.total_seconds() / YEAR
+            ).clip(lower_bound=0)
+        )
+        .sort(["repo", "cohort", "commit_date"])
+    )
+
+
+def survival_curves(cohorts: pl.DataFrame) -> pl.DataFrame:
+    """Fraction of each cohort's peak line count surviving at every sampled commit."""
+    by_cohort = ["repo", "cohort"]
+    return cohorts.with_columns(
+        surviving=pl.col("line_count") / pl.col("line_count").max().over(by_cohort),
+        after_peak=pl.col("commit_date") >= pl.col("commit_date")
+        .filter(pl.col("line_count") == pl.col("line_count").max())
+        .first()
+        .over(by_cohort),
+    ).select(["repo", "cohort", "commit_date", "age_years", "line_count", "surviving", "after_peak"])
+
+
+def half_lives(curves: pl.DataFrame) -> pl.DataFrame:
+    """Years after a cohort ended until half of its peak was gone, linearly interpolated.
+
+    Cohorts that never fell below half have a null half-life.
+    """
+    by_cohort = ["repo", "cohort"]
+    crossings = (
+        curves.filter("after_peak")
+        .with_columns(
+            prev_age=pl.col("age_years").shift(1).over(by_cohort),
+            prev_surviving=pl.col("surviving").shift(1).over(by_cohort),
+        )
+        .filter(pl.col("surviving") <= 0.5)
+        .group_by(by_cohort)
+        .agg(pl.all().sort_by("commit_date").first())
+        .with_columns(
+            half_life_years=pl.when(pl.col("prev_age").is_null())
+            .then(pl.col("age_years"))
+            .otherwise(
+                pl.col("prev_age")
+                + (pl.col("age_years") - pl.col("prev_age"))
+                * (pl.col("prev_surviving") - 0.5)
+                / (pl.col("prev_surviving") - pl.col("surviving"))
+            )
+        )
+        .select([*by_cohort, "half_life_years"])
+    )
+    return (
+        curves.group_by(by_cohort)
+        .agg(peak_lines=pl.col("line_count").max(), last_surviving=pl.col("surviving").last())
+        .join(crossings, on=by_cohort, how="left")
+        .sort(by_cohort)
+    )
+
+
+def release_turnover(cohorts: pl.DataFrame, versions: pl.DataFrame) -> pl.DataFrame:
+    """Share of lines present at each release that were removed before the next release.
+
+    Each release is snapped to the last sampled commit at or before its date.
+    """
+    snapshots = cohorts.select(["repo", "commit_date"]).unique().sort(["repo", "commit_date"])
+    releases = (
+        versions.sort(["repo", "datetime"])
+        .join_asof(
+            snapshots.rename({"commit_date": "snapshot"}),
+            left_on="datetime",
+            right_on="snapshot",
+            by="repo",
+            strategy="backward",
+            check_sortedness=False,
+        )
+        .drop_nulls("snapshot")
+        .unique(["repo", "snapshot"], keep="first")
+        .sort(["repo", "snapshot"])
+        .with_columns(next_snapshot=pl.col("snapshot").shift(-1).over("repo"))
+        .drop_nulls("next_snapshot")
+    )
+    counts = cohorts.select(["repo", "cohort", "commit_date", "line_count"])
+    return (
+        releases.join(counts, left_on=["repo", "snapshot"], right_on=["repo", "commit_date"])
+        .join(
+            counts,
+            left_on=["repo", "next_snapshot", "cohort"],
+            right_on=["repo", "commit_date", "cohort"],
+            how="left",
+            suffix="_next",
+        )
+        .with_columns(pl.col("line_count_next").fill_null(0))
+        .group_by(["repo", "version", "datetime", "snapshot", "next_snapshot"])
+        .agg(
+            lines=pl.col("line_count").sum(),
+            removed=(pl.col("line_count") - pl.col("line_count_next")).clip(lower_bound=0).sum(),
+        )
+        .with_columns(turnover=pl.col("removed") / pl.col("lines"))
+        .sort(["repo", "snapshot"])
+    )
+
+
+def summarize(half_life: pl.DataFrame, turnover: pl.DataFrame) -> pl.DataFrame:
+    """One row per repo for cross-repo comparison."""
+    return (
+        half_life.group_by("repo")
+        .agg(
+            cohorts=pl.len(),
+            median_half_life_years=pl.col("half_life_years").median(),
+            cohorts_halved=pl.col("half_life_years").is_not_null().sum(),
+        )
+        .join(
+            turnover.group_by("repo").agg(
+                releases=pl.len(), mean_release_turnover=pl.col("turnover").mean()
+            ),
+            on="repo",
+            how="left",
+        )
+        .sort("repo")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--granularity", choices=["year", "quarter"], default="year")
+    parser.add_argument("--charts-dir", type=Path, default=Path("charts"))
+    parser.add_argument("--output", type=Path, default=Path("analytics"))
+    args = parser.parse_args()
+
+    config = yaml.safe_load(Path("repos.yml").read_text())
+    names = [RepoParams(repo=entry["repo"]).repo_name for entry in config["repos"]]
+
+    lines, versions = load_cohorts(names, args.charts_dir)
+    cohorts = to_cohorts(lines, args.granularity)
+    curves = survival_curves(cohorts)
+    half_life = half_lives(curves)
+    turnover = release_turnover(cohorts, versions)
+    summary = summarize(half_life, turnover)
+
+    args.output.mkdir(exist_ok=True)
+    curves.write_csv(args.output / f"survival-{args.granularity}.csv")
+    half_life.write_csv(args.output / f"half-life-{args.granularity}.csv")
+    half_life.pivot(on="repo", index="cohort", values="half_life_years").sort("cohort").write_csv(
+        args.output / f"half-life-{args.granularity}-by-repo.csv"
+    )
+    turnover.write_csv(args.output / "release-turnover.csv")
+    summary.write_csv(args.output / "summary.csv")
+
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        print(summary)
+    print(f"Wrote analytics tables to {args.output}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,6 @@
 #     "marimo",
 #     "polars==1.35.2",
 #     "altair==6.0.0",
-#     "pydantic>=2.0.0",
 #     "diskcache==5.6.3",
 #     "tenacity>=8.0.0",
 #     "httpx>=0.27.0",
@@ -32,21 +31,60 @@ def _(mo):
     This notebook analyzes a git repository to visualize how code ages over time.
     It creates a stacked area chart showing lines of code broken down by the year
     each line was originally added, revealing how quickly code gets replaced.
+
+    The pipeline itself lives in `archaeology.py`, which also has a faster
+    command line interface: `uv run archaeology.py --repo <url>`.
     """)
     return
 
 
 @app.cell
 def _():
-    import subprocess
-    from datetime import datetime
-    import polars as pl
-    import altair as alt
-    alt.data_transformers.disable_max_rows()
-    from diskcache import Cache
+    from archaeology import (
+        DEFAULT_EXTENSIONS,
+        DEFAULT_SKIP_GLOBS,
+        RepoParams,
+        aggregate_by_period,
+        area_chart,
+        build_parser,
+        clone_or_update_repo,
+        collect_blame_data,
+        export_charts,
+        export_subproject_charts,
+        export_tiles,
+        get_commit_list,
+        get_version_rows,
+        load_blame_data,
+        prepare_repo,
+        resolve_repo_url,
+        sample_commits,
+        tile_windows,
+        version_layers,
+        with_title,
+    )
 
-    cache = Cache("git-research", timeout=300)
-    return alt, cache, datetime, pl, subprocess
+    return (
+        DEFAULT_EXTENSIONS,
+        DEFAULT_SKIP_GLOBS,
+        RepoParams,
+        aggregate_by_period,
+        area_chart,
+        build_parser,
+        clone_or_update_repo,
+        collect_blame_data,
+        export_charts,
+        export_subproject_charts,
+        export_tiles,
+        get_commit_list,
+        get_version_rows,
+        load_blame_data,
+        prepare_repo,
+        resolve_repo_url,
+        sample_commits,
+        tile_windows,
+        version_layers,
+        with_title,
+    )
 
 
 @app.cell(hide_code=True)
@@ -58,7 +96,7 @@ def _(mo):
 
 
 @app.cell
-def _(mo):
+def _(DEFAULT_EXTENSIONS, DEFAULT_SKIP_GLOBS, mo):
     params_form = (
         mo.md("""
     {repo_url}
@@ -66,6 +104,10 @@ def _(mo):
     {file_extensions}
 
     {sample_count}
+
+    {skip_globs}
+
+    {max_file_kb}
     """)
         .batch(
             repo_url=mo.ui.text(
@@ -74,7 +116,7 @@ def _(mo):
                 full_width=True,
             ),
             file_extensions=mo.ui.text(
-                value=".py,.js,.ts,.java,.c,.cpp,.h,.go,.rs,.rb,.md,.pyx,.cu,.rst",
+                value=DEFAULT_EXTENSIONS,
                 label="File extensions to analyze (comma-separated, leave empty for all)",
                 full_width=True,
             ),
@@ -85,6 +127,17 @@ def _(mo):
                 step=5,
                 label="Number of commits to sample",
             ),
+            skip_globs=mo.ui.text(
+                value=DEFAULT_SKIP_GLOBS,
+                label="Path globs to skip (comma-separated)",
+                full_width=True,
+            ),
+            max_file_kb=mo.ui.number(
+                start=0,
+                stop=100_000,
+                value=1024,
+                label="Skip files larger than this many KB (0 disables)",
+            ),
         )
         .form()
     )
@@ -117,263 +170,25 @@ def _(granularity_select, mo):
 
 
 @app.cell
-def _():
-    from pydantic import BaseModel, Field
-
-
-    class RepoParams(BaseModel):
-        repo: str = Field(description="Repository URL (HTTPS)")
-        samples: int = Field(default=200, description="Number of commits to sample")
-        file_extensions: str = Field(
-            default=".py,.js,.ts,.java,.c,.cpp,.h,.go,.rs,.rb,.md,.pyx,.cu,.rst",
-            description="Comma-separated file extensions to analyze",
-        )
-        version_source: str = Field(
-            default="git tags", description="Version source: none, git tags, or pypi"
-        )
-        pypi_name: str = Field(
-            default="", description="PyPI package name (defaults to repo name)"
-        )
-
-    return (RepoParams,)
-
-
-@app.cell
-def _(RepoParams, mo):
+def _(RepoParams, build_parser, mo, params_form):
     cli_args = mo.cli_args()
 
     if mo.app_meta().mode == "script":
         if "help" in cli_args or len(cli_args) == 0:
-            print("Usage: uv run git_archaeology.py --repo <url> [--samples <n>]")
-            print()
-            for name, field in RepoParams.model_fields.items():
-                default = " (required)" if field.is_required() else f" (default: {field.default})"
-                print(f"  --{name:12s} {field.description}{default}")
+            build_parser().print_help()
             exit()
         repo_params = RepoParams(**{k.replace("-", "_"): v for k, v in cli_args.items()})
-    return (repo_params,)
-
-
-@app.cell(hide_code=True)
-def _(subprocess):
-    from pathlib import Path
-    import hashlib
-
-    DOWNLOADS_DIR = Path(".downloads")
-
-
-    def get_cached_repo_path(repo_url: str) -> Path:
-        """Get the cached path for a repo URL, using a hash for uniqueness."""
-        repo_name = repo_url.rstrip("/").split("/")[-1].replace(".git", "")
-        url_hash = hashlib.md5(repo_url.encode(), usedforsecurity=False).hexdigest()[:8]
-        return DOWNLOADS_DIR / f"{repo_name}-{url_hash}"
-
-
-    def clone_or_update_repo(repo_url: str) -> Path:
-        """Clone repo if not cached, otherwise return cached path."""
-        DOWNLOADS_DIR.mkdir(exist_ok=True)
-        repo_path = get_cached_repo_path(repo_url)
-
-        if repo_path.exists():
-            # Repo already cached, fetch latest
-            subprocess.run(
-                ["git", "fetch", "--all"],
-                cwd=repo_path,
-                capture_output=True,
-            )
-        else:
-            # Clone fresh
-            subprocess.run(
-                ["git", "clone", repo_url, str(repo_path)],
-                capture_output=True,
-                check=True,
-            )
-        return repo_path
-
-    return Path, clone_or_update_repo, hashlib
-
-
-@app.cell(hide_code=True)
-def _(Path, cache, datetime, hashlib, pl, subprocess):
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    import re
-
-    # Pre-compile regex for timestamp extraction (used in get_blame_info)
-    TIMESTAMP_PATTERN = re.compile(r"\(.*?\s+(\d{10})\s+[+-]\d{4}\s+\d+\)")
-
-    # Single shared pool for file-level blame — avoids spinning up/down per commit
-    _file_executor = ThreadPoolExecutor(max_workers=32)
-
-
-    def run_git_command(cmd: list[str], repo_path: str) -> str:
-        """Run a git command and return stdout."""
-        result = subprocess.run(
-            cmd,
-            cwd=repo_path,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-        )
-        if result.returncode != 0:
-            raise RuntimeError(f"Git command failed: {result.stderr}")
-        return result.stdout
-
-
-    @cache.memoize()
-    def get_commit_list(repo_path: str) -> list[tuple[str, datetime]]:
-        """Get list of all commits with their dates."""
-        output = run_git_command(
-            ["git", "log", "--format=%H %at", "--reverse"],
-            repo_path,
-        )
-        commits = []
-        for line in output.strip().split("\n"):
-            if line:
-                parts = line.split()
-                commit_hash = parts[0]
-                timestamp = int(parts[1])
-                commit_date = datetime.fromtimestamp(timestamp)
-                commits.append((commit_hash, commit_date))
-        return commits
-
-
-    @cache.memoize()
-    def get_tracked_files(
-        repo_path: str, commit_hash: str, extensions: list[str] | None = None
-    ) -> list[tuple[str, str]]:
-        """Get list of (file_path, blob_hash) pairs at a specific commit."""
-        output = run_git_command(
-            ["git", "ls-tree", "-r", commit_hash],
-            repo_path,
+    elif params_form.value is not None:
+        repo_params = RepoParams(
+            repo=params_form.value["repo_url"],
+            samples=params_form.value["sample_count"],
+            file_extensions=params_form.value["file_extensions"],
+            skip_globs=params_form.value["skip_globs"],
+            max_file_kb=params_form.value["max_file_kb"],
         )
-        results = []
-        for line in output.strip().split("\n"):
-            if not line:
-                continue
-            # Format: <mode> <type> <blob_hash>\t<path>
-            meta, file_path = line.split("\t", 1)
-            blob_hash = meta.split()[2]
-            if extensions and not any(file_path.endswith(ext) for ext in extensions):
-                continue
-            results.append((file_path, blob_hash))
-        return results
-
-
-    def get_blame_info(repo_path: str, commit_hash: str, file_path: str) -> list[int]:
-        """Get blame timestamps for a file. Uses -t for raw timestamp output."""
-        try:
-            output = run_git_command(
-                ["git", "blame", "-t", commit_hash, "--", file_path],
-                repo_path,
-            )
-        except (RuntimeError, UnicodeDecodeError):
-            return []
-
-        return [
-            int(m.group(1))
-            for line in output.split("\n")
-            if line and (m := TIMESTAMP_PATTERN.search(line))
-        ]
-
-
-    def get_blame_by_blob(
-        blob_hash: str, repo_path: str, commit_hash: str, file_path: str
-    ) -> list[int]:
-        """Cache blame results by blob hash — identical blob = identical blame."""
-        cache_key = ("blame_v1", blob_hash)
-        cached = cache.get(cache_key)
-        if cached is not None:
-            return cached
-        result = get_blame_info(repo_path, commit_hash, file_path)
-        cache.set(cache_key, result)
-        return result
-
-
-    @cache.memoize()
-    def sample_commits(
-        commits: list[tuple[str, datetime]], n_samples: int
-    ) -> list[tuple[str, datetime]]:
-        """Sample n commits evenly distributed across history."""
-        if len(commits) <= n_samples:
-            return commits
-        step = len(commits) / n_samples
-        indices = [int(i * step) for i in range(n_samples)]
-        # Always include the last commit
-        if indices[-1] != len(commits) - 1:
-            indices[-1] = len(commits) - 1
-        return [commits[i] for i in indices]
-
-
-    @cache.memoize()
-    def analyze_single_commit(
-        repo_path: str,
-        commit_hash: str,
-        commit_timestamp: int,
-        extensions: list[str] | None,
-    ) -> list[tuple[int, int]]:
-        """Analyze a single commit with blob-level blame dedup."""
-        files = get_tracked_files(repo_path, commit_hash, extensions)
-
-        def blame_file(file_blob: tuple[str, str]) -> list[int]:
-            file_path, blob_hash = file_blob
-            return get_blame_by_blob(blob_hash, repo_path, commit_hash, file_path)
-
-        results = []
-        file_futures = {_file_executor.submit(blame_file, fb): fb for fb in files}
-        for future in as_completed(file_futures):
-            for ts in future.result():
-                results.append((commit_timestamp, ts))
-        return results
-
-
-    def _parquet_dir_for_run(repo_path, sampled_commits, extensions):
-        """Deterministic directory for parquet chunks based on run parameters."""
-        key = repr((repo_path, [(h, d.isoformat()) for h, d in sampled_commits], extensions))
-        run_hash = hashlib.sha256(key.encode()).hexdigest()[:12]
-        out = Path("git-research") / "parquet-chunks" / run_hash
-        out.mkdir(parents=True, exist_ok=True)
-        return out
-
-    def collect_blame_data(
-        repo_path: str,
-        sampled_commits: list[tuple[str, datetime]],
-        extensions: list[str] | None,
-        progress_bar=None,
-        is_script: bool = False,
-        max_workers: int = 32,
-    ) -> Path:
-        """Collect raw blame data, spilling each commit to a parquet file."""
-        parquet_dir = _parquet_dir_for_run(repo_path, sampled_commits, extensions)
-        total = len(sampled_commits)
-        done = 0
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {
-                executor.submit(
-                    analyze_single_commit, str(repo_path), h, int(d.timestamp()), extensions
-                ): (h, d)
-                for h, d in sampled_commits
-            }
-            for future in as_completed(futures):
-                commit_hash, _ = futures[future]
-                done += 1
-                if progress_bar:
-                    progress_bar.update(title=f"Analyzed {commit_hash[:8]}...")
-                if is_script:
-                    print(f"  [{done}/{total}] Analyzed {commit_hash[:8]}")
-                out_path = parquet_dir / f"{commit_hash}.parquet"
-                if not out_path.exists():
-                    rows = future.result()
-                    if rows:
-                        commit_ts, line_ts = zip(*rows)
-                        pl.DataFrame({
-                            "commit_date": list(commit_ts),
-                            "line_timestamp": list(line_ts),
-                        }).write_parquet(out_path)
-
-        return parquet_dir
-
-    return collect_blame_data, get_commit_list, re, sample_commits
+    else:
+        repo_params = None
+    return (repo_params,)
 
 
 @app.cell
@@ -381,71 +196,55 @@ def _(
     clone_or_update_repo,
     get_commit_list,
     mo,
-    params_form,
+    prepare_repo,
     repo_params,
+    resolve_repo_url,
     sample_commits,
 ):
     mo.stop(
-        mo.app_meta().mode != "script" and params_form.value is None,
+        repo_params is None,
         mo.md("Fill in the form above and click **Submit** to start."),
     )
 
     # Clone or use cached repo
-    repo_url = (
-        repo_params.repo
-        if mo.app_meta().mode == "script"
-        else params_form.value["repo_url"].strip()
-    )
-    # Accept short GitHub references like "koaning/scikit-lego"
-    if "/" in repo_url and not repo_url.startswith(("http://", "https://", "git@")):
-        repo_url = f"https://github.com/{repo_url}"
     with mo.status.spinner(f"Cloning/updating repository..."):
-        repo_path = clone_or_update_repo(repo_url)
-
-    # Parse configuration
-    n_samples = (
-        repo_params.samples if mo.app_meta().mode == "script" else params_form.value["sample_count"]
-    )
-    extensions_str = (
-        repo_params.file_extensions
-        if mo.app_meta().mode == "script"
-        else params_form.value["file_extensions"]
-    )
-    extensions_str = extensions_str.strip()
-    extensions = [ext.strip() for ext in extensions_str.split(",")] if extensions_str else None
+        repo_path = clone_or_update_repo(resolve_repo_url(repo_params.repo))
+    if repo_params.prepare:
+        with mo.status.spinner("Building commit-graph and pack indexes..."):
+            prepare_repo(repo_path, repo_params.extensions)
 
     # Get commits
     with mo.status.spinner("Getting commit history..."):
-        all_commits = get_commit_list(str(repo_path))
-        sampled = sample_commits(all_commits, n_samples)
+        all_commits = get_commit_list(
+            str(repo_path), repo_params.pathspecs, backend=repo_params.backend
+        )
+        sampled = sample_commits(all_commits, repo_params.samples)
 
     mo.md(f"Found **{len(all_commits)}** commits, sampling **{len(sampled)}** for analysis")
-    return extensions, repo_path, sampled
+    return all_commits, repo_path, sampled
 
 
 @app.cell
-def _(collect_blame_data, extensions, mo, pl, repo_path, sampled):
+def _(collect_blame_data, load_blame_data, mo, repo_params, repo_path, sampled):
     with mo.status.progress_bar(
         total=len(sampled),
         title="Analyzing commits",
         show_rate=True,
         show_eta=True,
     ) as bar:
-        parquet_dir = collect_blame_data(
+        dataset_dir = collect_blame_data(
             repo_path,
             sampled,
-            extensions,
+            repo_params.extensions,
             progress_bar=bar,
             is_script=mo.app_meta().mode == "script",
+            skip_rules=repo_params.skip_rules,
+            backend=repo_params.backend,
+            memory_budget_mb=repo_params.memory_budget_mb,
+            subprojects=repo_params.subproject_paths,
         )
 
-    parquet_files = list(parquet_dir.glob("*.parquet"))
-    if parquet_files:
-        raw_df = pl.read_parquet(parquet_files).with_columns(
-            pl.from_epoch("commit_date", time_unit="s").alias("commit_date")
-        )
-    else:
-        raw_df = pl.DataFrame({"commit_date": pl.Series([], dtype=pl.Datetime), "line_timestamp": pl.Series([], dtype=pl.Int64)})
+    raw_df = load_blame_data(dataset_dir, sampled)
     return (raw_df,)
 
 
@@ -458,184 +257,103 @@ def _(mo):
 
 
 @app.cell
-def _(granularity_select, pl, raw_df):
-    granularity = granularity_select.value
-
-    # Vectorized period derivation using native Polars dt ops
-    ts_col = pl.from_epoch(pl.col("line_timestamp"), time_unit="s")
-
-    if granularity == "Year":
-        period_expr = ts_col.dt.year().cast(pl.Utf8).alias("period")
-    else:  # Quarter
-        period_expr = pl.concat_str(
-            ts_col.dt.year().cast(pl.Utf8),
-            pl.lit("-Q"),
-            ((ts_col.dt.month() - 1) // 3 + 1).cast(pl.Utf8),
-        ).alias("period")
-
-    df = (
-        raw_df.with_columns(period_expr)
-        .group_by(["commit_date", "period"])
-        .len()
-        .rename({"len": "line_count"})
-        .sort(["commit_date", "period"])
+def _(aggregate_by_period, granularity_select, mo, raw_df, repo_params):
+    granularity = (
+        repo_params.granularity if mo.app_meta().mode == "script" else granularity_select.value
     )
-    return (df,)
+    df = aggregate_by_period(raw_df, granularity)
+    return df, granularity
 
 
 @app.cell
-def _(
-    datetime,
-    mo,
-    params_form,
-    re,
-    repo_params,
-    repo_path,
-    subprocess,
-    version_source,
-):
-
-    repo = repo_params.repo if mo.app_meta().mode == "script" else params_form.value["repo_url"]
-    parts = repo.rstrip("/").split("/")
-    repo_name = parts[-1].replace(".git", "")
-
+def _(get_version_rows, mo, repo_params, repo_path, version_source):
+    repo_name = repo_params.repo_name
     source = repo_params.version_source if mo.app_meta().mode == "script" else version_source.value
-    version_rows = []
-
-    if source == "git tags":
-        result = subprocess.run(
-            [
-                "git",
-                "for-each-ref",
-                "--sort=creatordate",
-                "--format=%(refname:short)|%(creatordate:unix)",
-                "refs/tags",
-            ],
-            cwd=repo_path,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-        )
-        VERSION_RE = re.compile(r"^v?(0|[1-9]\d*)\.(0|[1-9]\d*)\.0$")
-        for line in result.stdout.strip().split("\n"):
-            if line and VERSION_RE.match(line.split("|")[0]):
-                tag, ts = line.split("|", 1)
-                if ts.strip():
-                    version_rows.append(
-                        {"version": tag, "datetime": datetime.fromtimestamp(int(ts))}
-                    )
-
-    elif source == "pypi":
-        import httpx
-        from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-
-        @retry(
-            stop=stop_after_attempt(3),
-            wait=wait_exponential(multiplier=1, min=1, max=10),
-            retry=retry_if_exception_type((httpx.ConnectError, httpx.TimeoutException)),
-        )
-        def fetch_pypi(name):
-            return httpx.get(f"https://pypi.org/pypi/{name}/json")
-
-        pypi_name = (repo_params.pypi_name if mo.app_meta().mode == "script" else "") or repo_name
-        try:
-            resp = fetch_pypi(pypi_name)
-            if resp.status_code == 200:
-                for key, value in resp.json().get("releases", {}).items():
-                    if key.endswith(".0") and key != "0.0.0" and len(value) > 0:
-                        version_rows.append(
-                            {
-                                "version": key,
-                                "datetime": datetime.fromisoformat(value[0]["upload_time"]),
-                            }
-                        )
-        except Exception:
-            pass
+    version_rows = get_version_rows(repo_path, source, repo_name, repo_params.pypi_name)
     return repo_name, version_rows
 
 
 @app.cell
-def _(alt, pl, version_rows):
-    date_lines = None
-    date_text = None
-    if version_rows:
-        df_versions = pl.DataFrame(
-            version_rows, schema={"version": pl.Utf8, "datetime": pl.Datetime}
-        )
-        base_chart = alt.Chart(df_versions)
-
-        date_lines = base_chart.mark_rule(strokeDash=[5, 5]).encode(
-            x=alt.X("datetime:T", title="Date"), tooltip=["version:N", "datetime:T"]
-        )
-
-        date_text = base_chart.mark_text(angle=270, align="left", dx=15, dy=0).encode(
-            x="datetime:T", y=alt.value(10), text="version:N"
-        )
+def _(version_layers, version_rows):
+    date_lines, date_text = version_layers(version_rows)
     return date_lines, date_text
 
 
 @app.cell
 def _(
-    alt,
+    area_chart,
     date_lines,
     date_text,
     df,
-    granularity_select,
+    granularity,
     invert_layers,
     show_versions,
+    with_title,
 ):
-    color_title = "Year Added" if granularity_select.value == "Year" else "Quarter Added"
-    sort_order = "descending" if invert_layers.value else "ascending"
-
-    chart = (
-        alt.Chart(df)
-        .mark_area()
-        .encode(
-            x=alt.X("commit_date:T", title="Date"),
-            y=alt.Y("line_count:Q", title="Lines of Code"),
-            color=alt.Color(
-                "period:O",
-                scale=alt.Scale(scheme="viridis"),
-                title=color_title,
-            ),
-            order=alt.Order("period:O", sort=sort_order),
-            tooltip=["commit_date:T", "period:O", "line_count:Q"],
-        )
-    )
+    chart = area_chart(df, granularity, invert_layers.value)
 
     out = chart
     if show_versions.value and date_lines is not None:
         out += date_lines + date_text
 
-    out = out.properties(
-        title="Code Archaeology: Lines of Code by Period Added",
-        width=800,
-        height=500,
-    )
+    out = with_title(out)
 
     out
     return chart, out
 
 
 @app.cell
-def _(Path, alt, chart, date_lines, date_text, out, repo_name):
-    Path("charts").mkdir(exist_ok=True)
-
-    clean_path = Path("charts") / (repo_name + "-clean.json")
-    clean_path.write_text(out.to_json())
-
-    versioned_path = Path("charts") / (repo_name + "-versioned.json")
-    if date_lines is not None:
-        versioned_chart = (
-            (chart + date_lines + date_text)
-            .properties(
-                title="Code Archaeology: Lines of Code by Period Added",
-                width=800,
-                height=500,
+def _(
+    chart,
+    date_lines,
+    date_text,
+    export_charts,
+    export_subproject_charts,
+    granularity,
+    out,
+    raw_df,
+    repo_params,
+    version_rows,
+):
+    export_charts(repo_params.chart_name, out, chart, date_lines, date_text)
+    export_subproject_charts(
+        repo_params.chart_name, raw_df, repo_params.subproject_paths or [], granularity, version_rows
+    )
+    return
+
+
+@app.cell
+def _(
+    aggregate_by_period,
+    all_commits,
+    collect_blame_data,
+    export_tiles,
+    granularity,
+    load_blame_data,
+    mo,
+    repo_params,
+    repo_path,
+    tile_windows,
+):
+    # Denser per-year samples that the web frontend loads when zooming in
+    if repo_params.tile_samples:
+        tile_commits = tile_windows(all_commits, repo_params.tile_samples)
+        with mo.status.progress_bar(total=len(tile_commits), title="Building detail tiles") as tile_bar:
+            tile_dataset_dir = collect_blame_data(
+                repo_path,
+                tile_commits,
+                repo_params.extensions,
+                progress_bar=tile_bar,
+                is_script=mo.app_meta().mode == "script",
+                skip_rules=repo_params.skip_rules,
+                backend=repo_params.backend,
+                memory_budget_mb=repo_params.memory_budget_mb,
+                subprojects=repo_params.subproject_paths,
             )
-            .to_dict()
+        export_tiles(
+            repo_params.chart_name,
+            aggregate_by_period(load_blame_data(tile_dataset_dir, tile_commits), granularity),
         )
-        versioned_path.write_text(alt.Chart.from_dict(versioned_chart).to_json())
     return
 
 
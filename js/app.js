@@ -5,8 +5,13 @@ const state = {
   currentVariant: "clean",
   invertLayers: false,
   loadedCharts: {}, // Cache: {repo-variant: vegaSpec}
+  tileIndexes: {}, // Cache: {repo: tile index, or null without tiles}
+  loadedTiles: {}, // Cache: {repo/tile: Promise of rows}
 };
 
+// Above this many tiles in view, the overview chart already has enough points
+const MAX_VISIBLE_TILES = 3;
+
 // DOM Elements
 let repoSelect;
 let showVersionsCheckbox;
@@ -115,6 +120,18 @@ function applyInvert(spec) {
   return copy;
 }
 
+/**
+ * Add a zoom/pan interval bound to the x scale on the area layer
+ */
+function applyZoom(spec) {
+  const area = spec.layer ? spec.layer[0] : spec;
+  area.params = [
+    ...(area.params || []),
+    { name: "zoom", select: { type: "interval", encodings: ["x"] }, bind: "scales" },
+  ];
+  return spec;
+}
+
 async function renderChart(spec) {
   const embedOpt = {
     mode: "vega-lite",
@@ -132,13 +149,100 @@ async function renderChart(spec) {
     chartContainer.className = "";
 
     // Embed chart
-    await vegaEmbed("#chart-container", spec, embedOpt);
+    const result = await vegaEmbed("#chart-container", spec, embedOpt);
+    return result.view;
   } catch (error) {
     console.error("Error rendering chart:", error);
     throw error;
   }
 }
 
+// ========================================
+// Detail Tiles
+// ========================================
+
+/**
+ * Load the tile index written by `--tile-samples`, or null if the repo has none
+ */
+async function loadTileIndex(repo) {
+  if (!(repo in state.tileIndexes)) {
+    try {
+      const response = await fetch(`charts/tiles/${repo}/index.json`);
+      state.tileIndexes[repo] = response.ok ? await response.json() : null;
+    } catch (error) {
+      state.tileIndexes[repo] = null;
+    }
+  }
+  return state.tileIndexes[repo];
+}
+
+/**
+ * Load the rows of one tile, sharing the request between concurrent callers
+ */
+function loadTile(repo, tile) {
+  const cacheKey = `${repo}/${tile.url}`;
+
+  if (!state.loadedTiles[cacheKey]) {
+    state.loadedTiles[cacheKey] = fetch(`charts/tiles/${repo}/${tile.url}`).then((response) => {
+      if (!response.ok) {
+        delete state.loadedTiles[cacheKey];
+        throw new Error(`Tile not found: ${response.status}`);
+      }
+      return response.json();
+    });
+  }
+  return state.loadedTiles[cacheKey];
+}
+
+/**
+ * Merge the tiles overlapping the visible date range into the chart data
+ */
+async function loadVisibleTiles(view, repo, dataName, range, inserted) {
+  const extent = range && range.commit_date;
+  const index = extent && (await loadTileIndex(repo));
+  if (!index) return;
+
+  const [start, end] = extent.map((d) => new Date(d).getTime());
+  const visible = index.tiles.filter(
+    (tile) => new Date(tile.start).getTime() < end && new Date(tile.end).getTime() > start
+  );
+  if (visible.length > MAX_VISIBLE_TILES) return;
+
+  for (const tile of visible.filter((t) => !inserted.has(t.url))) {
+    inserted.add(tile.url);
+    let rows;
+    try {
+      rows = await loadTile(repo, tile);
+    } catch (error) {
+      console.error("Error loading tile:", error);
+      inserted.delete(tile.url);
+      continue;
+    }
+
+    // Commits sampled for both the overview and the tile are only drawn once
+    const rowKey = (row) => `${new Date(row.commit_date).getTime()}|${row.period}`;
+    const present = new Set(view.data(dataName).map(rowKey));
+    const added = rows.filter((row) => !present.has(rowKey(row))).map((row) => ({ ...row }));
+    if (added.length) {
+      await view.change(dataName, vega.changeset().insert(added)).runAsync();
+    }
+  }
+}
+
+/**
+ * Fetch detail tiles whenever the user zooms or pans the chart
+ */
+function watchZoom(view, repo, spec) {
+  const dataName = (spec.layer ? spec.layer[0] : spec).data.name;
+  const inserted = new Set();
+  let timer = null;
+
+  view.addSignalListener("zoom", (name, range) => {
+    clearTimeout(timer);
+    timer = setTimeout(() => loadVisibleTiles(view, repo, dataName, range, inserted), 250);
+  });
+}
+
 /**
  * Show loading state
  */
@@ -179,7 +283,8 @@ async function updateChart() {
 
   try {
     const spec = await loadChart(state.currentRepo, state.currentVariant);
-    await renderChart(applyInvert(spec));
+    const view = await renderChart(applyZoom(applyInvert(spec)));
+    watchZoom(view, state.currentRepo, spec);
   } catch (error) {
     showError(state.currentRepo, state.currentVariant);
   }
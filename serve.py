@@ -0,0 +1,228 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "polars==1.35.2",
+#     "altair==6.0.0",
+#     "diskcache==5.6.3",
+#     "tenacity>=8.0.0",
+#     "httpx>=0.27.0",
+# ]
+# ///
+
+"""Serve the chart site and compute missing or stale charts on demand.
+
+Static files (`index.html`, `charts/`, ...) are served from the working
+directory. Charts are requested through a small JSON API:
+
+- `GET /api/chart?repo=<repo>&<param>=<value>...` takes any `archaeology.py`
+  flag as a query parameter. A fresh chart is answered right away with
+  status `done`; otherwise a job is queued and returned with status `queued`.
+- `GET /api/jobs/<id>` reports a job's status and progress, for polling.
+
+Requests for the same repo and parameters share one job. Jobs run on a fixed
+number of workers behind a bounded queue; when the queue is full the request
+is refused with 503. Recomputing a chart reuses the blame cache and parquet
+chunks, so only new commits are blamed.
+"""
+
+import argparse
+import dataclasses
+import hashlib
+import json
+import queue
+import threading
+import time
+import traceback
+from functools import partial
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+from archaeology import CHARTS_DIR, RepoParams, get_cache, normalize_repo_url, run
+from generate_repos_list import main as generate_repos_list
+
+
+@dataclasses.dataclass
+class Job:
+    """One chart computation; doubles as the progress bar handed to `run`."""
+
+    id: str
+    params: RepoParams
+    status: str = "queued"
+    done: int = 0
+    total: int | None = None
+    message: str = ""
+    charts: list[str] = dataclasses.field(default_factory=list)
+    error: str | None = None
+
+    def update(self, title: str = "", **kwargs):
+        self.done += 1
+        self.message = title
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "repo": self.params.repo,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "message": self.message,
+            "charts": self.charts,
+            "error": self.error,
+        }
+
+
+def job_key(params: RepoParams) -> str:
+    """Identity of a chart request: the normalized repo URL plus every parameter."""
+    fields = dataclasses.asdict(params)
+    fields["repo"] = normalize_repo_url(params.repo)
+    return json.dumps(fields, sort_keys=True, default=str)
+
+
+def chart_paths(params: RepoParams) -> list[Path]:
+    return [CHARTS_DIR / f"{params.chart_name}-clean.json"]
+
+
+class ChartService:
+    """Deduplicating job queue in front of `archaeology.run`."""
+
+    def __init__(self, workers: int = 1, queue_size: int = 8, max_age_hours: float = 24):
+        self.max_age = max_age_hours * 3600
+        self.jobs: dict[str, Job] = {}
+        self.lock = threading.Lock()
+        self.repo_locks: dict[str, threading.Lock] = {}
+        self.queue: queue.Queue[Job] = queue.Queue(maxsize=queue_size)
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def is_fresh(self, params: RepoParams, key: str) -> bool:
+        """True if the chart exists, is recent enough and was built from these parameters.
+
+        Charts written by the CLI carry no record of their parameters, so they
+        only answer requests that use the default parameters.
+        """
+        paths = chart_paths(params)
+        if not all(path.exists() for path in paths):
+            return False
+        if time.time() - min(path.stat().st_mtime for path in paths) > self.max_age:
+            return False
+        served = get_cache().get(("served_chart_v1", params.chart_name))
+        if served is None:
+            return key == job_key(RepoParams(repo=params.repo))
+        return served == key
+
+    def submit(self, params: RepoParams) -> Job | None:
+        """Return the job for these parameters, queueing one if needed; None if the queue is full."""
+        key = job_key(params)
+        job_id = hashlib.sha1(key.encode()).hexdigest()[:12]
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.status in ("queued", "running"):
+                return job
+            if self.is_fresh(params, key):
+                if job is None or job.status != "done":
+                    job = Job(job_id, params, status="done")
+                    job.charts = [str(path) for path in chart_paths(params)]
+                    self.jobs[job_id] = job
+                return job
+            job = Job(job_id, params)
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                return None
+            self.jobs[job_id] = job
+            return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            repo_url = normalize_repo_url(job.params.repo)
+            with self.lock:
+                repo_lock = self.repo_locks.setdefault(repo_url, threading.Lock())
+            # One clone per repo: jobs for the same repo with other parameters wait here
+            with repo_lock:
+                job.status = "running"
+                try:
+                    job.charts = [str(path) for path in run(job.params, progress_bar=job)]
+                    get_cache().set(("served_chart_v1", job.params.chart_name), job_key(job.params))
+                    generate_repos_list()
+                    job.status = "done"
+                except Exception as e:
+                    traceback.print_exc()
+                    job.error = str(e)
+                    job.status = "failed"
+            self.queue.task_done()
+
+
+class Handler(SimpleHTTPRequestHandler):
+    """Static files plus the `/api/` endpoints."""
+
+    service: ChartService
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/api/chart":
+            self.request_chart(dict(parse_qsl(url.query)))
+        elif url.path.startswith("/api/jobs/"):
+            job = self.service.get(url.path.removeprefix("/api/jobs/"))
+            if job is None:
+                self.send_json(HTTPStatus.NOT_FOUND, {"error": "unknown job"})
+            else:
+                self.send_json(HTTPStatus.OK, job.to_dict())
+        else:
+            super().do_GET()
+
+    def request_chart(self, query: dict):
+        try:
+            # Accept the CLI spelling of flags too: `file-extensions` -> `file_extensions`
+            params = RepoParams(**{key.replace("-", "_"): value for key, value in query.items()})
+        except (TypeError, ValueError) as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+        job = self.service.submit(params)
+        if job is None:
+            self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": "job queue is full"})
+        elif job.status == "done":
+            self.send_json(HTTPStatus.OK, job.to_dict())
+        else:
+            self.send_json(HTTPStatus.ACCEPTED, job.to_dict())
+
+    def send_json(self, status: HTTPStatus, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            self.send_header("Retry-After", "30")
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Charts computed at the same time")
+    parser.add_argument("--queue-size", type=int, default=8, help="Jobs waiting before requests are refused")
+    parser.add_argument(
+        "--max-age-hours", type=float, default=24, help="Recompute charts older than this"
+    )
+    args = parser.parse_args()
+
+    Handler.service = ChartService(args.workers, args.queue_size, args.max_age_hours)
+    server = ThreadingHTTPServer((args.host, args.port), partial(Handler, directory=str(Path.cwd())))
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""The subprocess and pygit2 backends must return identical results."""
+
+import pytest
+
+from archaeology import Pygit2Backend, SubprocessBackend
+from helpers import commit, git
+
+pytest.importorskip("pygit2")
+
+
+@pytest.fixture(scope="module")
+def repo(tmp_path_factory):
+    """History with a merge, a rename, CRLF and no-trailing-newline files."""
+    repo = tmp_path_factory.mktemp("fixture")
+    git(repo, "init", "-q", "-b", "main")
+    git(repo, "config", "core.autocrlf", "false")
+    commit(
+        repo,
+        {"README.md": "# Fixture\n", "src/pkg/core.py": "a = 1\nb = 2\n"},
+        "initial",
+        "2020-01-01T12:00:00+00:00",
+    )
+    commit(
+        repo,
+        {"src/pkg/windows.py": "x = 1\r\ny = 2\r\n", "src/nonl.js": "let a = 1;\nlet b = 2;"},
+        "crlf and no trailing newline",
+        "2020-03-01T12:00:00+00:00",
+    )
+
+    git(repo, "checkout", "-q", "-b", "feature")
+    commit(
+        repo,
+        {"src/pkg/core.py": "a = 1\nb = 3\nc = 4\n", "docs/guide.md": "guide\n"},
+        "feature work",
+        "2020-04-01T12:00:00+00:00",
+    )
+    git(repo, "checkout", "-q", "main")
+    commit(
+        repo,
+        {"src/nonl.js": "let a = 1;\nlet b = 5;\nlet c = 6;", "README.md": "# Fixture\n\nMore.\n"},
+        "main work",
+        "2020-05-01T12:00:00+00:00",
+    )
+    git(repo, "merge", "-q", "--no-ff", "-m", "merge feature", "feature",
+        date="2020-06-01T12:00:00+00:00")
+
+    git(repo, "mv", "src/pkg/core.py", "src/pkg/renamed.py")
+    git(repo, "commit", "-q", "-m", "rename", date="2020-07-01T12:00:00+00:00")
+    commit(
+        repo,
+        {"src/pkg/renamed.py": "a = 1\nb = 3\nc = 4\nd = 5\n",
+         "src/pkg/windows.py": "x = 1\r\ny = 7\r\nz = 8"},
+        "after rename",
+        "2020-08-01T12:00:00+00:00",
+    )
+    return str(repo)
+
+
+@pytest.fixture(scope="module")
+def backends():
+    return SubprocessBackend(), Pygit2Backend()
+
+
+@pytest.fixture(scope="module")
+def commits(repo, backends):
+    return [commit_hash for commit_hash, _ in backends[0].list_commits(repo)]
+
+
+def test_list_commits(repo, backends):
+    subprocess_backend, pygit2_backend = backends
+    expected = subprocess_backend.list_commits(repo)
+    assert len(expected) == 7
+    assert pygit2_backend.list_commits(repo) == expected
+
+
+@pytest.mark.parametrize("pathspecs", [["src/pkg"], ["docs", ":(exclude)src"]])
+def test_list_commits_with_pathspecs(repo, backends, pathspecs):
+    subprocess_backend, pygit2_backend = backends
+    expected = subprocess_backend.list_commits(repo, pathspecs)
+    assert expected
+    assert pygit2_backend.list_commits(repo, pathspecs) == expected
+
+
+@pytest.mark.parametrize(
+    "paths", [None, ["src"], ["src/pkg", "README.md"], ["src/pkg/windows.py"], ["missing"]]
+)
+def test_list_tree(repo, backends, commits, paths):
+    subprocess_backend, pygit2_backend = backends
+    for commit_hash in commits:
+        expected = sorted(subprocess_backend.list_tree(repo, commit_hash, paths))
+        assert sorted(pygit2_backend.list_tree(repo, commit_hash, paths)) == expected
+
+
+def test_read_blob(repo, backends, commits):
+    subprocess_backend, pygit2_backend = backends
+    for commit_hash in commits:
+        for _, obj_type, blob_hash, _ in subprocess_backend.list_tree(repo, commit_hash):
+            assert obj_type == "blob"
+            expected = subprocess_backend.read_blob(repo, blob_hash)
+            assert pygit2_backend.read_blob(repo, blob_hash) == expected
+
+
+def test_blame(repo, backends, commits):
+    subprocess_backend, pygit2_backend = backends
+    for commit_hash in commits:
+        for file_path, _, _, _ in subprocess_backend.list_tree(repo, commit_hash):
+            expected = subprocess_backend.blame(repo, commit_hash, file_path)
+            assert expected
+            assert pygit2_backend.blame(repo, commit_hash, file_path) == expected
+
+
+def test_blame_missing_file(repo, backends, commits):
+    for backend in backends:
+        assert backend.blame(repo, commits[-1], "src/pkg/core.py") == []
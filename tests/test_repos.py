@@ -0,0 +1,108 @@
+"""Repo references, the download cache and the shared object store."""
+
+from pathlib import Path
+
+import pytest
+
+from archaeology import (
+    OBJECT_STORE,
+    clone_or_update_repo,
+    get_cached_repo_path,
+    normalize_repo_url,
+    resolve_repo_url,
+)
+from helpers import commit, git
+
+
+@pytest.mark.parametrize(
+    "repo",
+    [
+        "koaning/scikit-lego",
+        "https://github.com/koaning/scikit-lego",
+        "https://github.com/koaning/scikit-lego.git",
+        "https://github.com/Koaning/Scikit-Lego/",
+        "http://github.com/koaning/scikit-lego",
+        "git@github.com:koaning/scikit-lego.git",
+        "  koaning/scikit-lego  ",
+    ],
+)
+def test_equivalent_references_share_a_cache_entry(repo):
+    assert normalize_repo_url(repo) == "https://github.com/koaning/scikit-lego"
+    assert get_cached_repo_path(resolve_repo_url(repo)) == get_cached_repo_path(
+        "https://github.com/koaning/scikit-lego"
+    )
+
+
+def test_other_hosts_keep_their_case_outside_github():
+    assert normalize_repo_url("https://GitLab.com/Group/Project.git") == (
+        "https://gitlab.com/Group/Project"
+    )
+    assert get_cached_repo_path("https://gitlab.com/Group/Project") != get_cached_repo_path(
+        "https://gitlab.com/group/project"
+    )
+
+
+@pytest.mark.parametrize(
+    ("repo", "clone_url"),
+    [
+        ("koaning/scikit-lego", "https://github.com/koaning/scikit-lego"),
+        ("git@github.com:koaning/scikit-lego.git", "git@github.com:koaning/scikit-lego.git"),
+        ("http://example.com/repo.git", "http://example.com/repo.git"),
+        ("https://github.com/Koaning/Scikit-Lego.git", "https://github.com/Koaning/Scikit-Lego.git"),
+    ],
+)
+def test_clone_url_is_the_given_url(repo, clone_url):
+    assert resolve_repo_url(repo) == clone_url
+
+
+def test_local_paths_become_file_urls(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    expected = (tmp_path / "repo").resolve().as_uri()
+    assert resolve_repo_url("./repo") == expected
+    assert resolve_repo_url(str(tmp_path / "repo") + "/") == expected
+    assert resolve_repo_url(expected) == expected
+    assert normalize_repo_url("./repo/") == expected
+
+
+def local_objects(repo_path: Path) -> int:
+    """Objects stored in the clone itself rather than borrowed through alternates."""
+    counts = dict(line.split(": ") for line in git(repo_path, "count-objects", "-v").splitlines())
+    return int(counts["count"]) + int(counts["in-pack"])
+
+
+def test_fork_clone_borrows_objects_from_the_store(tmp_path, monkeypatch):
+    upstream = tmp_path / "upstream"
+    upstream.mkdir()
+    git(upstream, "init", "-q", "-b", "main")
+    commit(upstream, {"a.py": "a = 1\n"}, "initial", "2020-01-01T12:00:00+00:00")
+    commit(upstream, {"a.py": "a = 2\n"}, "second", "2020-02-01T12:00:00+00:00")
+    git(tmp_path, "clone", "-q", str(upstream), "fork")
+    fork = tmp_path / "fork"
+    commit(fork, {"b.py": "b = 1\n"}, "fork work", "2020-03-01T12:00:00+00:00")
+
+    # .downloads/ and its object store are created below the working directory
+    work = tmp_path / "work"
+    work.mkdir()
+    monkeypatch.chdir(work)
+    upstream_clone = clone_or_update_repo(resolve_repo_url(str(upstream)))
+    fork_clone = clone_or_update_repo(resolve_repo_url(str(fork)))
+    assert upstream_clone != fork_clone
+
+    store_objects = (OBJECT_STORE / "objects").resolve()
+    for clone in (upstream_clone, fork_clone):
+        alternates = clone / ".git" / "objects" / "info" / "alternates"
+        borrowed = [
+            (alternates.parent.parent / line).resolve() for line in alternates.read_text().split()
+        ]
+        assert borrowed == [store_objects]
+        assert local_objects(clone) == 0
+
+    fork_head = git(fork, "rev-parse", "HEAD").strip()
+    assert git(fork_clone, "rev-parse", "HEAD").strip() == fork_head
+    assert git(fork_clone, "rev-list", "--count", "HEAD").strip() == "3"
+    git(OBJECT_STORE, "cat-file", "-e", fork_head)
+
+    # Updating a cached clone moves it to the new upstream commit
+    commit(upstream, {"a.py": "a = 3\n"}, "third", "2020-04-01T12:00:00+00:00")
+    assert clone_or_update_repo(resolve_repo_url(str(upstream))) == upstream_clone
+    assert git(upstream_clone, "rev-parse", "HEAD") == git(upstream, "rev-parse", "HEAD")
@@ -2,17 +2,28 @@
 # requires-python = ">=3.11"
 # dependencies = [
 #     "pyyaml>=6.0",
+#     "polars==1.35.2",
+#     "altair==6.0.0",
+#     "diskcache==5.6.3",
+#     "tenacity>=8.0.0",
+#     "httpx>=0.27.0",
 # ]
 # ///
 
-"""Read repos.yml and run git_archaeology.py for each repo."""
+"""Read repos.yml and run the archaeology pipeline for each repo.
+
+All repos are processed in this one process, so imports and the cache are
+set up once instead of once per repo.
+"""
 
-import subprocess
 import sys
+import traceback
 from pathlib import Path
 
 import yaml
 
+from archaeology import RepoParams, run
+
 
 def main():
     config = yaml.safe_load(Path("repos.yml").read_text())
@@ -23,16 +34,15 @@ def main():
         print(f"Updating {repo}...")
         print(f"{'='*60}")
 
-        cmd = [
-            "uv", "run", "git_archaeology.py",
-            "--repo", repo,
-            "--version_source", "pypi",
-        ]
-        if "pypi_name" in entry:
-            cmd.extend(["--pypi_name", entry["pypi_name"]])
-
-        result = subprocess.run(cmd)
-        if result.returncode != 0:
+        params = RepoParams(
+            repo=repo,
+            version_source="pypi",
+            pypi_name=entry.get("pypi_name", ""),
+        )
+        try:
+            run(params)
+        except Exception:
+            traceback.print_exc()
             print(f"WARNING: Failed to update {repo}", file=sys.stderr)
 
 